@@ -3,10 +3,19 @@
 
 
 import sys
+import csv
+import getopt
+import itertools
+import json
+import multiprocessing
 import os
 import os.path
+import re
+import sqlite3
 
-from functools import reduce
+from internal.git import GitRepo, GitError
+from internal.stattable import StatTable
+from internal.statcache import StatCache, DEFAULT_MAX_ENTRIES, default_path as default_cache_path
 
 
 if sys.version_info.major != 3:
@@ -18,215 +27,374 @@ class FileInfo():
         pass
 
 
-class TextStatisticHandler():
-    def __init__(self):
-        self.last_byte = None
-        self.line_no = 0
+class Language():
+    """
+    what a scanner needs to know about a language: the tokens that start a comment running to
+    the end of the line, the (start, end) pairs of block comments, and the string delimiters,
+    the ones in `multiline_strings` can span lines. a backslash escapes the next byte in a string.
+    a file without a known extension is taken for the language if its "#!" line runs one of
+    `interpreters`, or if it starts with one of `magic` (case insensitive)
+    """
+    def __init__(self, name, extensions, line_comments=(), block_comments=(), strings=(),
+                 multiline_strings=(), interpreters=(), magic=()):
+        self.name = name
+        self.extensions = extensions
+        self.line_comments = line_comments
+        self.block_comments = block_comments
+        self.strings = strings
+        self.multiline_strings = multiline_strings
+        self.interpreters = interpreters
+        self.magic = magic
+
+
+C_COMMENTS = {"line_comments": ("//",), "block_comments": (("/*", "*/"),)}
+
+LANGUAGES = [
+    Language("Text", (".txt", ".md", ".rst")),
+    Language("Python", (".py", ".pyw"), line_comments=("#",), strings=('"', "'"),
+             multiline_strings=('"""', "'''"), interpreters=("python",)),
+    Language("C", (".c", ".h"), strings=('"', "'"), **C_COMMENTS),
+    Language("C++", (".cc", ".cpp", ".cxx", ".hh", ".hpp", ".hxx"), strings=('"', "'"), **C_COMMENTS),
+    Language("Objective-C", (".m", ".mm"), strings=('"', "'"), **C_COMMENTS),
+    Language("C#", (".cs",), strings=('"', "'"), **C_COMMENTS),
+    Language("Java", (".java",), strings=('"', "'"), multiline_strings=('"""',), **C_COMMENTS),
+    Language("Kotlin", (".kt", ".kts"), strings=('"',), multiline_strings=('"""',), **C_COMMENTS),
+    Language("Scala", (".scala",), strings=('"',), multiline_strings=('"""',), **C_COMMENTS),
+    Language("Go", (".go",), strings=('"', "'"), multiline_strings=("`",), **C_COMMENTS),
+    Language("Rust", (".rs",), strings=('"',), **C_COMMENTS),
+    Language("Swift", (".swift",), strings=('"',), multiline_strings=('"""',), **C_COMMENTS),
+    Language("JavaScript", (".js", ".mjs", ".cjs", ".jsx"), strings=('"', "'"), multiline_strings=("`",),
+             interpreters=("node", "nodejs"), **C_COMMENTS),
+    Language("TypeScript", (".ts", ".tsx"), strings=('"', "'"), multiline_strings=("`",), **C_COMMENTS),
+    Language("CSS", (".css",), block_comments=(("/*", "*/"),), strings=('"', "'")),
+    Language("PHP", (".php",), line_comments=("//", "#"), block_comments=(("/*", "*/"),),
+             strings=('"', "'"), interpreters=("php",), magic=("<?php",)),
+    Language("Shell", (".sh", ".bash", ".zsh"), line_comments=("#",), multiline_strings=('"', "'"),
+             interpreters=("sh", "bash", "dash", "ksh", "zsh")),
+    Language("Perl", (".pl", ".pm"), line_comments=("#",), strings=('"', "'"), interpreters=("perl",)),
+    Language("Ruby", (".rb",), line_comments=("#",), strings=('"', "'"), interpreters=("ruby",)),
+    Language("Lua", (".lua",), line_comments=("--",), block_comments=(("--[[", "]]"),), strings=('"', "'"),
+             interpreters=("lua",)),
+    Language("SQL", (".sql",), line_comments=("--",), block_comments=(("/*", "*/"),), strings=("'",)),
+    Language("Haskell", (".hs",), line_comments=("--",), block_comments=(("{-", "-}"),), strings=('"',)),
+    Language("XML", (".xml", ".xsd", ".xsl", ".svg", ".html", ".htm", ".xhtml"),
+             block_comments=(("<!--", "-->"),), magic=("<?xml", "<!doctype", "<html", "<svg")),
+    Language("YAML", (".yml", ".yaml"), line_comments=("#",)),
+    Language("TOML", (".toml",), line_comments=("#",), strings=('"', "'")),
+    Language("INI", (".ini", ".cfg"), line_comments=(";", "#")),
+]
+
+
+class Scanner():
+    """
+    a language compiled into regexes: one finding the next token that opens a block comment or
+    multi-line string, one for each of those finding what ends it, and one telling the comment
+    only lines. a token is checked against the tokens before it on its line, it may be in a
+    string or a comment there. the lines in between are counted a stretch at a time, only block
+    comments and multi-line strings cost a turn of the loop
+    """
+    NEWLINE = re.compile(b'\n')
+    NON_BLANK = re.compile(b'[^ \t\r\f\v\n]')
+    # up to the last newline
+    LINES = re.compile(b'.*\n', re.DOTALL)
+
+    def __init__(self, language):
+        self.language = language
+        # a token that opens a block comment or multi-line string -> (the regex finding its end,
+        # whether it's a comment). a backslash and the byte after it are found in strings, so
+        # an escaped delimiter isn't taken for the end
+        self.ends = {}
+        for start, end in language.block_comments:
+            self.ends[start.encode()] = (re.compile(re.escape(end.encode())), True)
+        for token in language.multiline_strings:
+            self.ends[token.encode()] = (re.compile(b'\\\\[^\n]|' + re.escape(token.encode())), False)
+
+        strings = sorted((token.encode() for token in language.strings), key=len, reverse=True)
+        line_comments = sorted((token.encode() for token in language.line_comments), key=len, reverse=True)
+        # the longest first, so '"""' isn't taken for '"'
+        opens = sorted(self.ends, key=len, reverse=True)
+        self.opening = re.compile(b'|'.join(re.escape(token) for token in opens)) if opens else None
+        self.line_comments = tuple(line_comments)
+        comments = b'|'.join(re.escape(token) for token in line_comments)
+        self.line_comment = re.compile(comments) if line_comments else None
+        # what every line starts with: '\n' if it's blank, a line comment token if that's all
+        # there is, a byte of code otherwise. whole lines are told apart by one findall()
+        self.line_start = re.compile(b'^[ \t\r\f\v]*(\n|' + (comments + b'|' if comments else b'') + b'[^\n])',
+                                     re.MULTILINE)
+        self.token = None
+        if opens or line_comments or strings:
+            # each alternative starts with a literal and there are no groups, so the regex can skip
+            # to the bytes a match can start with
+            alternatives = [re.escape(token) for token in opens]
+            # comments that end with their line are taken whole
+            for token in line_comments:
+                alternatives.append(re.escape(token) + b'[^\n]*')
+            # and so are one line strings, they're just code
+            for q in strings:
+                e = re.escape(q)
+                if len(q) == 1:
+                    alternatives.append(e + b'(?:[^\\\\\n' + e + b']|\\\\.)*' + e)
+                else:
+                    alternatives.append(e + b'(?:\\\\.|[^\\\\\n])*?' + e)
+            # one that isn't closed on its line ends there
+            for q in strings:
+                alternatives.append(re.escape(q) + b'[^\n]*')
+            self.token = re.compile(b'|'.join(alternatives))
+
+    def next_open(self, buf, pos, end):
+        """
+        the match of the first token in buf[pos:end] opening a block comment or multi-line string,
+        None if there's none. pos isn't in a string or comment, and no line starts in one
+        """
+        if self.opening is None:
+            return None
+        while True:
+            m = self.opening.search(buf, pos, end)
+            if m is None:
+                return None
+            at = m.start()
+            # the tokens of its line before it, from where the line starts or pos
+            lines = self.LINES.match(buf, pos, at)
+            p = pos if lines is None else lines.end()
+            while True:
+                # the token regex matches at `at` at least, openers come first in it
+                token = self.token.search(buf, p, end)
+                if token.start() == at:
+                    return token
+                if token.end() > at:
+                    # it's in a string or a line comment
+                    break
+                p = token.end()
+            pos = token.end()
+
+    def new_handler(self):
+        return LanguageStatisticHandler(self)
+
+
+class LanguageStatisticHandler():
+    """
+    counts the code, comment and blank lines of a file with a Scanner. a line with anything but
+    comments on it is code, one with comments only (or inside a block comment) is comment, an
+    empty or white space only one is blank. whole lines are scanned, the unfinished one at the
+    end of a buffer is kept for the next
+    """
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.code = 0
+        self.comment = 0
+        self.blank = 0
+        # the unfinished line at the end of the last buffer
+        self.tail = bytearray()
+        # the token of the block comment or multi-line string we're in
+        self.open = None
 
     def handle(self, buf):
-        self.last_byte = buf[-1]
-        self.line_no = reduce(lambda x, _: x + 1,
-                              filter(lambda x: x == ord('\r'), buf),
-                              self.line_no)
-
-    def end(self):
-        if self.last_byte is None:
+        pos = 0
+        if self.tail:
+            # the unfinished line of the last buffer, finished with the first line of this one
+            m = self.scanner.NEWLINE.search(buf)
+            if m is None:
+                self.tail += buf
+                return
+            self.tail += buf[:m.end()]
+            self.scan(self.tail, 0, len(self.tail))
+            pos = m.end()
+        m = self.scanner.LINES.match(buf, pos)
+        if m is None:
+            self.tail = bytearray(buf[pos:])
             return
-        if self.last_byte not in b'\r\n':
-            self.line_no += 1
-
-    def get(self):
-        info = FileInfo()
-        info.line_no = self.line_no
-        return info
-
-    def dump(self):
-        return self.line_no
-
-
-class XmlStatisticHandler():
-    def __init__(self):
-        self.last_byte = None
-        self.line_no = 0
-
-    def handle(self, buf):
-        self.last_byte = buf[-1]
-
-    def end(self):
-        if self.last_byte is None:
+        self.scan(buf, pos, m.end())
+        self.tail = bytearray(buf[m.end():])
+
+    def scan(self, buf, pos, end):
+        """ count the lines of buf[pos:end], it starts a line and ends with a newline """
+        scanner = self.scanner
+        if scanner.token is None:
+            self.count_lines(buf, pos, end)
             return
-
-    def get(self):
-        info = FileInfo()
-        info.line_no = self.line_no
-        return info
-
-    def dump(self):
-        return self.line_no
-
-
-class PythonStatisticHandler():
-    def __init__(self):
-        self.line_no = 0
-        self.begin_of_line = True
-        self.ignore_to_end = False
-
-    def handle(self, buf):
-        for b in buf:
-            if b == ord('#'):
-                if self.begin_of_line:
-                    self.ignore_to_end = True
-                    self.begin_of_line = False
-            elif b == ord('\n'):
-                if not self.ignore_to_end and not self.begin_of_line:
-                    self.line_no += 1
-                self.ignore_to_end = False
-                self.begin_of_line = True
-            elif b in b' \r\t':
-                # begin_of_line = False
-                pass
+        newline = scanner.NEWLINE
+        non_blank = scanner.NON_BLANK
+        lines_re = scanner.LINES
+        line_comment = scanner.line_comment
+        ends = scanner.ends
+        code = comment = blank = 0
+        open_token = self.open
+        # what the line we're in has so far, one that starts inside a comment or string has some
+        if open_token is None:
+            has_code = has_comment = False
+        else:
+            end_re, in_comment = ends[open_token]
+            has_comment = in_comment
+            has_code = not in_comment
+        while pos < end:
+            if open_token is None:
+                m = scanner.next_open(buf, pos, end)
+                stop = end if m is None else m.start()
+                nl = newline.search(buf, pos, stop)
+                if nl is None:
+                    # still on the same line, a line comment would have run past the token
+                    if not has_code and stop > pos and non_blank.search(buf, pos, stop) is not None:
+                        has_code = True
+                else:
+                    # the rest of the line we're in: code unless all there is a line comment
+                    nb = non_blank.search(buf, pos, nl.start())
+                    if has_code or nb is not None and (line_comment is None or
+                                                       line_comment.match(buf, nb.start()) is None):
+                        code += 1
+                    elif has_comment or nb is not None:
+                        comment += 1
+                    else:
+                        blank += 1
+                    # then the whole lines up to the token's line, all of them at once
+                    start = nl.end()
+                    lines = lines_re.match(buf, start, stop)
+                    if lines is not None:
+                        self.count_lines(buf, start, lines.end())
+                        start = lines.end()
+                    has_code = stop > start and non_blank.search(buf, start, stop) is not None
+                    has_comment = False
+                if m is None:
+                    break
+                pos = m.end()
+                open_token = m.group()
+                end_re, in_comment = ends[open_token]
+                if in_comment:
+                    has_comment = True
+                else:
+                    has_code = True
             else:
-                self.begin_of_line = False
+                m = end_re.search(buf, pos, end)
+                stop = end if m is None else m.start()
+                n = len(newline.findall(buf, pos, stop))
+                if n:
+                    # the lines of a string are code, of a comment comment, but for the first
+                    # one if it has code before the comment
+                    if not in_comment:
+                        code += n
+                    elif has_code:
+                        code += 1
+                        comment += n - 1
+                        has_code = False
+                    else:
+                        comment += n
+                if m is None:
+                    break
+                pos = m.end()
+                if in_comment or buf[m.start()] != ord('\\'):
+                    # not an escape in a string
+                    open_token = None
+        self.open = open_token
+        self.code += code
+        self.comment += comment
+        self.blank += blank
+
+    def count_lines(self, buf, start, end):
+        """ count the whole lines of buf[start:end], none of them in a block comment or string """
+        firsts = self.scanner.line_start.findall(buf, start, end)
+        blank = firsts.count(b'\n')
+        comment = 0
+        for token in self.scanner.line_comments:
+            comment += firsts.count(token)
+        self.code += len(firsts) - blank - comment
+        self.comment += comment
+        self.blank += blank
 
     def end(self):
-        if not self.begin_of_line and not self.ignore_to_end:
-            self.line_no += 1
+        if self.tail:
+            # the last line, without a newline
+            self.tail += b'\n'
+            self.scan(self.tail, 0, len(self.tail))
+            self.tail = bytearray()
 
     def get(self):
         info = FileInfo()
-        info.line_no = self.line_no
+        info.language = self.scanner.language.name
+        info.code = self.code
+        info.comment = self.comment
+        info.blank = self.blank
+        # what was counted before there was a breakdown
+        info.line_no = self.code
         return info
 
-    def dump(self):
-        return self.line_no
 
+# bytes read at a time, the -b option
+BLOCK_SIZE = 1 << 20
 
-class CppStatisticHandler():
-    COMMENT_NONE = 0
-    # "//"
-    COMMENT_LINE = 1
-    # "/" --+--> "//"
-    # |
-    #       +--> "/*"
-    COMMENT_PRE = 2
-    # "/* "
-    COMMENT_BLOCK = 3
-    # "*" --> "*/"
-    COMMENT_POST_BLOCK = 4
 
-    def __init__(self):
-        self.line_no = 0
-        self.comment_type = self.COMMENT_NONE
-        # for skipping blank line
-        self.has_code = False
+# what's read first, to tell the type of a file before it's counted
+PROBE_SIZE = 1 << 15
 
-    def handle(self, buf):
-        for b in buf:
-            # print("type: {}, b: {}".format(self.comment_type, chr(b)))
-            if self.comment_type == self.COMMENT_NONE:
-                if b == ord('/'):
-                    self.comment_type = self.COMMENT_PRE
-                elif b in b' \r\t':
-                    # ignore
-                    pass
-                elif b == ord('\n'):
-                    if self.has_code:
-                        self.line_no += 1
-                    self.has_code = False
-                else:
-                    self.has_code = True
-            elif self.comment_type == self.COMMENT_LINE:
-                if b == ord('\n'):
-                    self.comment_type = self.COMMENT_NONE
-                    self.has_code = False
-            elif self.comment_type == self.COMMENT_PRE:
-                if b == ord('/'):
-                    self.comment_type = self.COMMENT_LINE
-                elif b == ord('*'):
-                    self.comment_type = self.COMMENT_BLOCK
-                else:
-                    if b == ord('\n'):
-                        self.line_no += 1
-                        self.has_code = False
-                    else:
-                        self.has_code = True
-                    self.comment_type = self.COMMENT_NONE
-            elif self.comment_type == self.COMMENT_BLOCK:
-                if b == ord('*'):
-                    self.comment_type = self.COMMENT_POST_BLOCK
-                elif b == ord('\n'):
-                    if self.has_code:
-                        self.line_no += 1
-                    self.has_code = False
-            elif self.comment_type == self.COMMENT_POST_BLOCK:
-                if b == ord('/'):
-                    self.comment_type = self.COMMENT_NONE
-                elif b == ord('\n'):
-                    self.has_code = False
-            else:
-                raise Exception("Unknown comment type, something was wrong, tell me: zhaoyi.zero@gmail.com")
 
-    def end(self):
-        if self.has_code:
-            self.line_no += 1
+def read_blocks(f, block_size=BLOCK_SIZE, first_size=None):
+    """
+    yield the content of file `f` as memoryviews of one reusable buffer, so a view is only
+    valid until the next one is asked for. the first one is `first_size` bytes whatever
+    `block_size` is (or all of a shorter file), the type of a file doesn't change with -b
+    """
+    buf = bytearray(max(block_size, first_size or 0))
+    view = memoryview(buf)
+    size = first_size or block_size
+    with open(f, "rb", buffering=0) as fp:
+        while True:
+            n = fp.readinto(view[:size])
+            if not n:
+                break
+            yield view[:n]
+            size = block_size
 
-    def get(self):
-        info = FileInfo()
-        info.line_no = self.line_no
-        return info
 
-    def dump(self):
-        return self.line_no
+def compile_languages(languages):
+    """ return extension -> a function making a new handler for it """
+    handlers = {}
+    for language in languages:
+        scanner = Scanner(language)
+        for extension in language.extensions:
+            handlers[extension] = scanner.new_handler
+    return handlers
 
 
-def statistic_text(f):
-    handler = TextStatisticHandler()
-    with open(f, "rb") as fp:
-        for buf in iter(lambda: fp.read(1024), b''):
-            handler.handle(buf)
-        handler.end()
-    print("{}: {}".format(f, handler.dump()))
-    return handler.get()
+STATISTIC_HANDLERS = compile_languages(LANGUAGES)
 
+def sniff_table(languages):
+    """
+    return interpreter -> the extension of its language, and [(start of a file, lower cased,
+    the extension of its language)], files taken for a language are counted as its first extension
+    """
+    interpreters = {}
+    magic = []
+    for language in languages:
+        for name in language.interpreters:
+            interpreters[name] = language.extensions[0]
+        for start in language.magic:
+            magic.append((start.encode(), language.extensions[0]))
+    return interpreters, magic
 
-def statistic_xml(f):
-    handler = XmlStatisticHandler()
-    with open(f, "rb") as fp:
-        for buf in iter(lambda: fp.read(1024), b''):
-            handler.handle(buf)
-        handler.end()
-        # handler.end()
-    print("{}: {}".format(f, handler.dump()))
-    return handler.get()
 
+INTERPRETERS, MAGIC = sniff_table(LANGUAGES)
 
-# doesn't support unicode file yet
-def statistic_python(f):
-    handler = PythonStatisticHandler()
-    with open(f, "rb") as fp:
-        for buf in iter(lambda: fp.read(1024), b''):
-            handler.handle(buf)
-        handler.end()
-    print("{}: {}".format(f, handler.dump()))
-    return handler.get()
+# the starts of common binary files that may have no NUL early on
+BINARY_MAGIC = (b"\x7fELF", b"\x89PNG", b"GIF8", b"\xff\xd8\xff", b"PK\x03\x04", b"\x1f\x8b",
+                b"%PDF", b"BZh", b"\xfd7zXZ", b"7z\xbc\xaf")
+NUL = re.compile(b'\0')
+# "#!/usr/bin/env -S python3 -u" -> "python3", "#!/bin/sh" -> "sh"
+SHEBANG = re.compile(b'#![ \t]*(?:\\S*/)?(?:env[ \t]+(?:-\\S*[ \t]+)*)?(?:\\S*/)?([A-Za-z_]+)')
 
 
-def statistic_cpp(f):
-    handler = CppStatisticHandler()
-    with open(f, "rb") as fp:
-        for buf in iter(lambda: fp.read(1024), b''):
-            handler.handle(buf)
-        handler.end()
-    print("{}: {}".format(f, handler.dump()))
-    return handler.get()
+def is_binary(first):
+    """ whether the file starting with `first` is binary: a NUL in it, or a known magic number """
+    return NUL.search(first) is not None or bytes(first[:8]).startswith(BINARY_MAGIC)
 
 
-STATISTIC_HANDLERS = {
-    ".py": statistic_python,
-    ".cc": statistic_cpp,
-    ".java": statistic_cpp,
-    ".txt": statistic_text,
-}
+def sniff_type(first):
+    """ the extension of the language of a file starting with `first`, None if it doesn't tell """
+    m = SHEBANG.match(first)
+    if m is not None:
+        return INTERPRETERS.get(m.group(1).decode())
+    start = bytes(first[:64]).lstrip().lower()
+    for magic, extension in MAGIC:
+        if start.startswith(magic):
+            return extension
+    return None
 
 
 def get_type_by_file_name(file_name):
@@ -239,50 +407,494 @@ def get_type_by_file_name(file_name):
         return None
 
 
-def statistic_dir(d):
+def walk_files(d):
     for dir_path, dir_names, file_names in os.walk(d):
         for f in file_names:
-            yield statistic_file(os.path.join(dir_path, f))
+            yield os.path.join(dir_path, f)
 
 
-def statistic_file(f):
+def describe(f, info):
+    return "{}: {} code, {} comment, {} blank".format(f, info.code, info.comment, info.blank)
+
+
+def count_blocks(handler_type, blocks):
+    handler = handler_type()
+    for buf in blocks:
+        handler.handle(buf)
+    handler.end()
+    return handler.get()
+
+
+def unsupported(f, file_type):
+    return "file [{}] (as type {}) doesn't support".format(f, file_type)
+
+
+def skipped(f, data):
+    """ the report of a file that wasn't counted, `data` is what the cache keeps about it """
+    if data["skipped"] == "binary":
+        return "file [{}] is binary, skipped".format(f)
+    return unsupported(f, data["type"])
+
+
+def count_content(f, file_type, blocks):
+    """
+    count the file whose content `blocks` yields, of type `file_type` (None if its name doesn't
+    tell), return its info, or a dict telling why it's skipped. only the first block is looked at
+    before deciding, and it's counted as the start of the file, not read again
+    """
+    handler_type = STATISTIC_HANDLERS.get(file_type, None)
+    first = next(blocks, None)
+    if first is not None and is_binary(first):
+        blocks.close()
+        return {"skipped": "binary", "type": file_type}
+    if handler_type is None and first is not None:
+        sniffed = sniff_type(first)
+        if sniffed is not None:
+            file_type = sniffed
+            handler_type = STATISTIC_HANDLERS[sniffed]
+    if handler_type is None:
+        blocks.close()
+        return {"skipped": "unsupported", "type": file_type}
+    info = count_blocks(handler_type, itertools.chain((first,), blocks) if first is not None else ())
+    info.type = file_type
+    return info
+
+
+# doesn't support unicode file yet
+def count_file(f, block_size=BLOCK_SIZE, cache=None):
+    """
+    count file `f`, or take its result from `cache`. return (info, the report line(s) to print,
+    cache key, what to keep in the cache, None if it came from there), info is None if `f`
+    isn't counted
+    """
     file_names = os.path.basename(f)
     file_type = get_type_by_file_name(file_names)
-    handler = STATISTIC_HANDLERS.get(file_type, None)
-    if handler is None:
-        print(type(f))
-        print("file [{}] (as type {}) doesn't support".format(f, file_type))
-        return None
-    info = handler(f)
-    info.type = file_type
+    key = None
+    if cache is not None:
+        key = cache.key(f)
+        data = cache.get(key)
+        if data is not None:
+            return result(f, data) + (key, None)
+    data = count_content(f, file_type, read_blocks(f, block_size, PROBE_SIZE))
+    return result(f, data) + (key, data)
+
+
+def result(f, data):
+    """ (info, report) from what count_content() returned or the cache kept """
+    if isinstance(data, FileInfo):
+        return data, describe(f, data)
+    if "skipped" in data:
+        return None, skipped(f, data)
+    info = FileInfo()
+    info.__dict__.update(data)
+    return info, describe(f, info)
+
+
+def update_cache(cache, key, data):
+    if key is None:
+        return
+    if data is None:
+        cache.touch(key)
+    else:
+        cache.put(key, data if isinstance(data, dict) else vars(data))
+
+
+class TextOutput():
+    """
+    where the results go, as text. every output writes through the one buffered `stream` and
+    keeps nothing but what it needs to close what it started
+    """
+    def __init__(self, stream, summary_only=False):
+        self.stream = stream
+        self.summary_only = summary_only
+
+    def file(self, f, info, report):
+        """ the result of file `f`, `info` is None if it wasn't counted """
+        if not self.summary_only:
+            self.stream.write(report + "\n")
+
+    def totals(self, target, stat_info):
+        """ the per-type totals of `target` (a file, a directory, REV:dir) """
+        for file_type, (code, comment, blank) in stat_info.items():
+            self.stream.write("{}: {} code, {} comment, {} blank\n".format(file_type, code, comment, blank))
+
+    def top(self, target, rows):
+        """ the largest files of `target`, (path, type, language, code, comment, blank) rows """
+        self.stream.write("top {} of {}:\n".format(len(rows), target))
+        for path, file_type, language, code, comment, blank in rows:
+            self.stream.write("  {}: {} code, {} comment, {} blank\n".format(path, code, comment, blank))
+
+    def dirs(self, target, rows):
+        """ the totals of the directories of `target`, (directory, code, comment, blank) rows """
+        for directory, code, comment, blank in rows:
+            self.stream.write("{}/: {} code, {} comment, {} blank\n".format(directory, code, comment, blank))
+
+    def languages(self, target, rows):
+        """ the totals of each language in `target`, (language, (code, comment, blank)) rows """
+        all_code = sum(code for language, (code, comment, blank) in rows) or 1
+        for language, (code, comment, blank) in rows:
+            self.stream.write("{}: {:.1f}% ({} code)\n".format(language, 100.0 * code / all_code, code))
+
+    def revision(self, rev):
+        """ what follows is about revision `rev`, said only if there's more than one """
+        self.stream.write("[{}]\n".format(rev))
+
+    def close(self):
+        self.stream.flush()
+
+
+class JsonlOutput(TextOutput):
+    """
+    one JSON object a line, {"file": ...} for each file counted, {"total": ...} for each type,
+    then {"top": ...}, {"dir": ...} and {"language": ...} for the rollups asked for
+    """
+    def file(self, f, info, report):
+        if not self.summary_only and info is not None:
+            self.record({"file": f, "type": info.type, "language": info.language, "code": info.code,
+                         "comment": info.comment, "blank": info.blank})
+
+    def totals(self, target, stat_info):
+        for file_type, (code, comment, blank) in stat_info.items():
+            self.record({"total": target, "type": file_type, "code": code, "comment": comment,
+                         "blank": blank})
+
+    def top(self, target, rows):
+        for path, file_type, language, code, comment, blank in rows:
+            self.record({"top": path, "type": file_type, "language": language, "code": code,
+                         "comment": comment, "blank": blank})
+
+    def dirs(self, target, rows):
+        for directory, code, comment, blank in rows:
+            self.record({"dir": directory, "code": code, "comment": comment, "blank": blank})
+
+    def languages(self, target, rows):
+        all_code = sum(code for language, (code, comment, blank) in rows) or 1
+        for language, (code, comment, blank) in rows:
+            self.record({"language": language, "code": code, "comment": comment, "blank": blank,
+                         "percent": round(100.0 * code / all_code, 1)})
+
+    def revision(self, rev):
+        # the targets and files have it in their names
+        pass
+
+    def record(self, record):
+        self.stream.write(json.dumps(record) + "\n")
+
+
+class JsonOutput(JsonlOutput):
+    """ the records of JsonlOutput, as one JSON array written as they come """
+    def __init__(self, stream, summary_only=False):
+        super().__init__(stream, summary_only)
+        self.separator = "[\n"
+
+    def record(self, record):
+        self.stream.write(self.separator + json.dumps(record))
+        self.separator = ",\n"
+
+    def close(self):
+        # an empty array if there was nothing
+        self.stream.write("[]\n" if self.separator == "[\n" else "\n]\n")
+        self.stream.flush()
+
+
+class CsvOutput(JsonlOutput):
+    """ the records of JsonlOutput as CSV rows, what they are ("file", "total", ...) in the first column """
+    COLUMNS = ("kind", "name", "type", "language", "code", "comment", "blank", "percent")
+
+    def __init__(self, stream, summary_only=False):
+        super().__init__(stream, summary_only)
+        self.writer = csv.writer(stream, lineterminator="\n")
+        self.writer.writerow(self.COLUMNS)
+
+    def record(self, record):
+        # the first key tells what it is
+        kind = next(iter(record))
+        self.writer.writerow((kind, record[kind], record.get("type", ""), record.get("language", ""),
+                              record["code"], record["comment"], record["blank"], record.get("percent", "")))
+
+
+OUTPUTS = {
+    "text": TextOutput,
+    "json": JsonOutput,
+    "jsonl": JsonlOutput,
+    "csv": CsvOutput,
+}
+
+
+OUTPUT_BUFFER_SIZE = 1 << 16
+
+
+def default_output():
+    return TextOutput(sys.stdout)
+
+
+def statistic_file(f, block_size=BLOCK_SIZE, cache=None, out=None):
+    info, report, key, data = count_file(f, block_size, cache)
+    out.file(f, info, report)
+    update_cache(cache, key, data)
     return info
 
 
-def statistic(f):
+def statistic_dir(d, block_size=BLOCK_SIZE, cache=None, out=None):
+    for f in walk_files(d):
+        yield f, statistic_file(f, block_size, cache, out)
+
+
+_worker_block_size = BLOCK_SIZE
+_worker_cache = None
+
+
+def _init_worker(block_size, cache_path):
+    global _worker_block_size, _worker_cache
+    _worker_block_size = block_size
+    if cache_path is not None:
+        _worker_cache = StatCache(cache_path, readonly=True)
+        _worker_cache.open()
+
+
+def _count_worker(f):
+    return (f,) + count_file(f, _worker_block_size, _worker_cache)
+
+
+# files handed to a worker at a time, most are small and one at a time costs more in messages than counting
+POOL_CHUNK = 16
+
+
+def statistic_dir_parallel(d, jobs, block_size=BLOCK_SIZE, cache=None, out=None):
+    """
+    like statistic_dir(), with the files counted on a pool of `jobs` processes. the workers
+    look results up in `cache` themselves, this process writes the new ones
+    """
+    cache_path = cache.path if cache is not None else None
+    with multiprocessing.Pool(jobs, _init_worker, (block_size, cache_path)) as pool:
+        # `imap` pulls the walk from its own thread, so workers start on the first files while
+        # the rest of the tree is still being listed, and gives the results back in walk order
+        for f, info, report, key, data in pool.imap(_count_worker, walk_files(d), POOL_CHUNK):
+            out.file(f, info, report)
+            update_cache(cache, key, data)
+            yield f, info
+
+
+def add_info(stat_info, info):
+    """ fold the result of one file into the per-type totals """
+    if info is None:
+        return
+    if info.type not in stat_info.keys():
+        stat_info[info.type] = [0, 0, 0]
+    total = stat_info[info.type]
+    total[0] += info.code
+    total[1] += info.comment
+    total[2] += info.blank
+
+
+class Rollups():
+    """ what's reported from the per-file results besides the per-type totals """
+    def __init__(self, top=0, by_dir=None, languages=False):
+        self.top = top
+        self.by_dir = by_dir
+        self.languages = languages
+
+    def wanted(self):
+        return self.top > 0 or self.by_dir is not None or self.languages
+
+    def report(self, table, target, out):
+        if self.top > 0:
+            out.top(target, table.top(self.top))
+        if self.by_dir is not None:
+            out.dirs(target, table.dir_totals(target, self.by_dir))
+        if self.languages:
+            out.languages(target, table.language_totals())
+
+
+def add_row(table, f, info):
+    if table is not None and info is not None:
+        table.add(f, info.type, info.language, info.code, info.comment, info.blank)
+
+
+def statistic(f, block_size=BLOCK_SIZE, jobs=1, cache=None, out=None, rollups=None):
+    if out is None:
+        out = default_output()
     stat_info = {}
+    # the per-file results are only kept if something needs them
+    table = StatTable() if rollups is not None and rollups.wanted() else None
     if os.path.isdir(f):
-        for info in statistic_dir(f):
-            if info is None:
-                continue
-            if info.type not in stat_info.keys():
-                stat_info[info.type] = 0
-            stat_info[info.type] += info.line_no
+        if jobs > 1:
+            infos = statistic_dir_parallel(f, jobs, block_size, cache, out)
+        else:
+            infos = statistic_dir(f, block_size, cache, out)
+        for name, info in infos:
+            add_info(stat_info, info)
+            add_row(table, name, info)
     else:
-        info = statistic_file(f)
-        if info is not None:
-            stat_info[info.type] = info.line_no
-
-    for item in stat_info.items():
-        print("{}: {}".format(item[0], item[1]))
+        info = statistic_file(f, block_size, cache, out)
+        add_info(stat_info, info)
+        add_row(table, f, info)
+
+    out.totals(f, stat_info)
+    if table is not None:
+        rollups.report(table, f, out)
+
+
+def statistic_blob(repo, sha, path, name, block_size=BLOCK_SIZE, cache=None, memo=None):
+    """
+    count blob `sha` as a file named `path`, return (info, report about `name`). results are kept
+    in `memo` and `cache` by blob id, so a blob that's in many revisions is only read once
+    """
+    file_type = get_type_by_file_name(os.path.basename(path))
+    # the same content counts differently under another extension
+    memo_key = (sha, file_type)
+    data = memo.get(memo_key) if memo is not None else None
+    if data is None:
+        # not a path, but what a blob's result depends on never changes
+        key = ("git-blob:{}{}".format(sha, file_type), 0, 0, 0)
+        data = cache.get(key) if cache is not None else None
+        if data is not None:
+            cache.touch(key)
+        else:
+            data = count_content(path, file_type, repo.blob_blocks(sha, block_size, PROBE_SIZE))
+            if cache is not None:
+                update_cache(cache, key, data)
+        if memo is not None:
+            memo[memo_key] = data
+    return result(name, data)
+
+
+def statistic_rev(f, rev, block_size=BLOCK_SIZE, cache=None, memo=None, out=None, rollups=None):
+    """ like statistic(), for `f` as it is in revision `rev` of its git repository """
+    if out is None:
+        out = default_output()
+    if os.path.isdir(f):
+        repo, paths = GitRepo(f), ()
+    else:
+        repo, paths = GitRepo(os.path.dirname(f) or "."), (os.path.basename(f),)
+    stat_info = {}
+    table = StatTable() if rollups is not None and rollups.wanted() else None
+    try:
+        for sha, path in repo.ls_tree(rev, paths):
+            # what `git show` takes
+            name = "{}:{}".format(rev, os.path.join(f, path) if paths == () else f)
+            info, report = statistic_blob(repo, sha, path, name, block_size, cache, memo)
+            out.file(name, info, report)
+            add_info(stat_info, info)
+            add_row(table, name, info)
+    finally:
+        repo.close()
+    target = "{}:{}".format(rev, f)
+    out.totals(target, stat_info)
+    if table is not None:
+        rollups.report(table, target, out)
+
+
+def usage():
+    print("Usage: codestat.py [-b block-size] [-j jobs] [--no-cache] [--cache=FILE] [--cache-max=N]\n"
+          "                   [--rev=REV...] [--format=text|json|jsonl|csv] [--summary-only]\n"
+          "                   [--top=N] [--by-dir=DEPTH] [--languages] file-or-dir...")
 
 
 def main():
-    args = sys.argv[1:]
-    file_list = args
-    # file_list = filter(lambda x: not x.startswith("--"), args)
-    # opt_list = filter(lambda x: x.startswith("--"), args)
-    for f in file_list:
-        statistic(f)
+    try:
+        opt_list, file_list = getopt.getopt(sys.argv[1:], "b:j:",
+                                             ["block-size=", "jobs=", "no-cache", "cache=", "cache-max=", "rev=",
+                                              "format=", "summary-only", "top=", "by-dir=", "languages"])
+    except getopt.GetoptError as e:
+        print(e)
+        usage()
+        return 1
+    block_size = BLOCK_SIZE
+    jobs = 1
+    cache_path = default_cache_path()
+    cache_max = DEFAULT_MAX_ENTRIES
+    revs = []
+    output_type = TextOutput
+    summary_only = False
+    rollups = Rollups()
+    for opt, arg in opt_list:
+        if opt in ("-b", "--block-size"):
+            try:
+                block_size = int(arg)
+            except ValueError:
+                block_size = 0
+            if block_size <= 0:
+                print("invalid block size: {}".format(arg))
+                return 1
+        elif opt in ("-j", "--jobs"):
+            try:
+                jobs = int(arg)
+            except ValueError:
+                print("invalid number of jobs: {}".format(arg))
+                return 1
+            if jobs <= 0:
+                jobs = os.cpu_count() or 1
+        elif opt == "--no-cache":
+            cache_path = None
+        elif opt == "--cache":
+            cache_path = arg
+        elif opt == "--cache-max":
+            try:
+                cache_max = int(arg)
+            except ValueError:
+                print("invalid cache size: {}".format(arg))
+                return 1
+        elif opt == "--rev":
+            revs.append(arg)
+        elif opt == "--format":
+            output_type = OUTPUTS.get(arg)
+            if output_type is None:
+                print("unknown format: {}".format(arg))
+                usage()
+                return 1
+        elif opt == "--summary-only":
+            summary_only = True
+        elif opt in ("--top", "--by-dir"):
+            try:
+                n = int(arg)
+            except ValueError:
+                n = -1
+            if n < 0:
+                print("invalid {}: {}".format(opt, arg))
+                return 1
+            if opt == "--top":
+                rollups.top = n
+            else:
+                rollups.by_dir = n
+        elif opt == "--languages":
+            rollups.languages = True
+
+    cache = None
+    if cache_path is not None:
+        cache = StatCache(cache_path, cache_max)
+        try:
+            cache.open()
+        except (OSError, sqlite3.Error) as e:
+            # counting works without it, just slower
+            print("cache {} not used: {}".format(cache_path, e), file=sys.stderr)
+            cache = None
+    # one big buffer instead of a write (and a flush, on a terminal) for every line
+    stream = open(sys.stdout.fileno(), "w", buffering=OUTPUT_BUFFER_SIZE, encoding=sys.stdout.encoding,
+                  errors="backslashreplace", closefd=False)
+    out = output_type(stream, summary_only)
+    try:
+        if not revs:
+            for f in file_list:
+                statistic(f, block_size, jobs, cache, out, rollups)
+            return 0
+        # blob id -> result, for the blobs shared by the revisions
+        memo = {}
+        for rev in revs:
+            if len(revs) > 1:
+                out.revision(rev)
+            for f in file_list or ["."]:
+                statistic_rev(f, rev, block_size, cache, memo, out, rollups)
+    except GitError as e:
+        stream.flush()
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        out.close()
+        stream.close()
+        if cache is not None:
+            cache.close()
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
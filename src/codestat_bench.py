@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of codestat on generated corpora.
+
+The corpora are made from a seed, so every run (and every machine) counts the same bytes:
+many small files, a few huge ones, a deep tree, and files heavy in comments or in code. For
+every language's handler the throughput is measured on the files in memory, without I/O,
+then a whole statistic() run over each corpus is timed. Results can be saved as a baseline,
+and a later run compared against it fails when anything got slower than the tolerance allows.
+"""
+
+import sys
+import getopt
+import io
+import json
+import os
+import os.path
+import random
+import shutil
+import tempfile
+import time
+
+import codestat
+
+
+if sys.version_info.major != 3:
+    raise Exception("Wrong python major version")
+
+
+# extension -> what the generated lines look like
+SYNTAX = {
+    ".py": {"comment": "# {}", "block": ('"""', '"""'), "code": ["{} = {}({})", "if {} and {}:", "return '{}'"],
+            "indent": "    "},
+    ".cc": {"comment": "// {}", "block": ("/*", " */"), "code": ["int {} = {}({});", "if ({} && {}) {{", "s = \"{}\";"],
+            "indent": "  "},
+    ".java": {"comment": "// {}", "block": ("/**", " */"),
+              "code": ["final int {} = {}({});", "if ({} && {}) {{", "s = \"{}\";"], "indent": "    "},
+    ".txt": {"comment": "{}", "block": ("", ""), "code": ["{} {} {}."], "indent": ""},
+}
+
+WORDS = ["alpha", "beta", "gamma", "delta", "value", "count", "index", "buffer", "result", "handler",
+         "offset", "length", "name", "item", "node", "state", "token", "line", "block", "file"]
+
+# name -> (files, (min lines, max lines), directory depth, share of comment lines, extensions)
+PROFILES = {
+    "small": (2000, (5, 60), 2, 0.2, (".py", ".cc", ".java", ".txt")),
+    "huge": (3, (150000, 200000), 0, 0.2, (".py", ".cc", ".txt")),
+    "deep": (400, (20, 200), 12, 0.2, (".py", ".cc")),
+    "comments": (200, (300, 800), 2, 0.7, (".py", ".cc", ".java")),
+    "code": (200, (300, 800), 2, 0.03, (".py", ".cc", ".java")),
+}
+
+# bumped when the generated content changes, so an old corpus isn't reused
+CORPUS_VERSION = 1
+CORPUS_MARK = ".codestat-bench"
+
+
+def generate_lines(rng, syntax, n, comment_share):
+    """ `n` lines of made-up source in `syntax` """
+    lines = []
+    depth = 0
+    while len(lines) < n:
+        r = rng.random()
+        words = rng.sample(WORDS, 3)
+        if r < 0.1:
+            lines.append("")
+        elif r < 0.1 + comment_share * 0.8:
+            lines.append(syntax["indent"] * depth + syntax["comment"].format(" ".join(words)))
+        elif r < 0.1 + comment_share:
+            start, end = syntax["block"]
+            lines.append(start)
+            lines.extend(" * " + " ".join(rng.sample(WORDS, 5)) for i in range(rng.randint(1, 6)))
+            lines.append(end)
+        else:
+            line = rng.choice(syntax["code"]).format(*words)
+            lines.append(syntax["indent"] * depth + line)
+            depth = max(0, min(4, depth + rng.choice((-1, 0, 0, 1))))
+    return "\n".join(lines[:n]) + "\n"
+
+
+def generate_corpus(root, profile, seed):
+    """ write the corpus `profile` made from `seed` under `root`, return the number of bytes """
+    files, (min_lines, max_lines), depth, comment_share, extensions = PROFILES[profile]
+    rng = random.Random("{}:{}".format(seed, profile))
+    total = 0
+    for i in range(files):
+        parts = ["d{}".format(rng.randint(0, 3)) for level in range(rng.randint(0, depth))]
+        directory = os.path.join(root, *parts)
+        os.makedirs(directory, exist_ok=True)
+        extension = rng.choice(extensions)
+        content = generate_lines(rng, SYNTAX[extension], rng.randint(min_lines, max_lines), comment_share)
+        data = content.encode()
+        with open(os.path.join(directory, "f{}{}".format(i, extension)), "wb") as fp:
+            fp.write(data)
+        total += len(data)
+    return total
+
+
+def prepare_corpus(base, profile, seed):
+    """ the directory of corpus `profile` under `base`, generated unless it's already there """
+    root = os.path.join(base, profile)
+    mark = os.path.join(root, CORPUS_MARK)
+    expected = "{} {}".format(CORPUS_VERSION, seed)
+    try:
+        with open(mark) as fp:
+            if fp.read() == expected:
+                return root
+    except OSError:
+        pass
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+    generate_corpus(root, profile, seed)
+    with open(mark, "w") as fp:
+        fp.write(expected)
+    return root
+
+
+def load_files(root):
+    """ extension -> [content of every file of it under root] """
+    contents = {}
+    for f in codestat.walk_files(root):
+        extension = codestat.get_type_by_file_name(os.path.basename(f))
+        if extension in codestat.STATISTIC_HANDLERS:
+            with open(f, "rb") as fp:
+                contents.setdefault(extension, []).append(fp.read())
+    return contents
+
+
+def best_time(fn, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_handler(handler_type, contents, block_size, repeat):
+    """ (files/s, MB/s) of `handler_type` over `contents`, in blocks like read_blocks() gives """
+    def run():
+        for data in contents:
+            view = memoryview(data)
+            handler = handler_type()
+            for pos in range(0, len(data), block_size):
+                handler.handle(view[pos:pos + block_size])
+            handler.end()
+    elapsed = best_time(run, repeat) or 1e-9
+    return len(contents) / elapsed, sum(map(len, contents)) / elapsed / 1e6
+
+
+def bench_statistic(root, jobs, block_size, repeat):
+    """ (files/s, MB/s) of a whole statistic() run over `root`, without the cache """
+    files = 0
+    size = 0
+    for f in codestat.walk_files(root):
+        if os.path.basename(f) != CORPUS_MARK:
+            files += 1
+            size += os.path.getsize(f)
+
+    def run():
+        out = codestat.TextOutput(io.StringIO())
+        codestat.statistic(root, block_size, jobs, None, out)
+    elapsed = best_time(run, repeat) or 1e-9
+    return files / elapsed, size / elapsed / 1e6
+
+
+def language_of(extension):
+    return codestat.STATISTIC_HANDLERS[extension]().scanner.language.name
+
+
+def run_benchmarks(base, profiles, seed, jobs, block_size, repeat):
+    """ return {metric name: MB/s}, printing every result as it comes """
+    results = {}
+    for profile in profiles:
+        root = prepare_corpus(base, profile, seed)
+        for extension, contents in sorted(load_files(root).items()):
+            files_per_s, mb_per_s = bench_handler(codestat.STATISTIC_HANDLERS[extension], contents,
+                                                  block_size, repeat)
+            name = "handler/{}/{}".format(language_of(extension), profile)
+            print("{:32} {:6} files {:8.2f} MB {:10.0f} files/s {:8.2f} MB/s".format(
+                name, len(contents), sum(map(len, contents)) / 1e6, files_per_s, mb_per_s))
+            results[name] = mb_per_s
+        files_per_s, mb_per_s = bench_statistic(root, jobs, block_size, repeat)
+        name = "statistic/{}".format(profile)
+        print("{:32} {:6} {:>8} {:>3} {:10.0f} files/s {:8.2f} MB/s".format(name, "", "", "", files_per_s, mb_per_s))
+        results[name] = mb_per_s
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """ print the metrics that got slower than `tolerance` allows, return how many did """
+    failures = 0
+    for name, expected in sorted(baseline.items()):
+        got = results.get(name)
+        if got is None:
+            continue
+        if got < expected * (1 - tolerance):
+            print("REGRESSION {}: {:.2f} MB/s, baseline {:.2f} MB/s ({:+.0f}%)".format(
+                name, got, expected, (got / expected - 1) * 100))
+            failures += 1
+    return failures
+
+
+def usage():
+    print("Usage: codestat_bench.py [-d corpus-dir] [--seed=N] [--profile=NAME...] [--repeat=N] [-j jobs]\n"
+          "                         [-b block-size] [--save-baseline=FILE] [--baseline=FILE] [--tolerance=X]\n"
+          "profiles: {}".format(", ".join(PROFILES)))
+
+
+def main():
+    try:
+        opt_list, args = getopt.getopt(sys.argv[1:], "d:j:b:h",
+                                       ["seed=", "profile=", "repeat=", "save-baseline=", "baseline=",
+                                        "tolerance=", "help"])
+    except getopt.GetoptError as e:
+        print(e)
+        usage()
+        return 2
+    base = None
+    seed = 1
+    profiles = []
+    repeat = 3
+    jobs = 1
+    block_size = codestat.BLOCK_SIZE
+    save_baseline = None
+    baseline = None
+    tolerance = 0.2
+    try:
+        for opt, arg in opt_list:
+            if opt == "-d":
+                base = arg
+            elif opt == "--seed":
+                seed = int(arg)
+            elif opt == "--profile":
+                if arg not in PROFILES:
+                    print("unknown profile: {}".format(arg))
+                    usage()
+                    return 2
+                profiles.append(arg)
+            elif opt == "--repeat":
+                repeat = max(1, int(arg))
+            elif opt == "-j":
+                jobs = int(arg)
+            elif opt == "-b":
+                block_size = int(arg)
+            elif opt == "--save-baseline":
+                save_baseline = arg
+            elif opt == "--baseline":
+                baseline = arg
+            elif opt == "--tolerance":
+                tolerance = float(arg)
+            elif opt in ("-h", "--help"):
+                usage()
+                return 0
+    except ValueError as e:
+        print(e)
+        usage()
+        return 2
+
+    # a corpus given with -d is kept for the next run, a temporary one isn't
+    temporary = base is None
+    if temporary:
+        base = tempfile.mkdtemp(prefix="codestat-bench-")
+    try:
+        results = run_benchmarks(base, profiles or list(PROFILES), seed, jobs, block_size, repeat)
+    finally:
+        if temporary:
+            shutil.rmtree(base, ignore_errors=True)
+
+    if save_baseline is not None:
+        with open(save_baseline, "w") as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+            fp.write("\n")
+    if baseline is not None:
+        with open(baseline) as fp:
+            failures = compare(results, json.load(fp), tolerance)
+        if failures > 0:
+            return 1
+        print("no regression against {} (tolerance {:.0f}%)".format(baseline, tolerance * 100))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,13 +4,24 @@
 * ndiff:    lists every line and highlights interline changes.
 * context:  highlights clusters of changes in a before/after format.
 * unified:  highlights clusters of changes in an inline format.
-* html:     generates side by side comparison with change highlights.
+* html:     generates side by side comparison with change highlights, a hunk at a time.
 
+The context and unified formats can come from a Myers, patience or histogram diff of interned
+lines (--algorithm) instead of difflib.SequenceMatcher, which crawls on large inputs.
+
+With -r two directory trees are compared: entries on one side only are reported, files of
+equal size and content are skipped, and the rest are diffed, on a pool of processes with -j.
+
+With --mmap the files are never read into lists of str: lines are offsets into a memory map
+and 64-bit hashes, and only the lines of the hunks printed are decoded.
 """
 
-import sys, os, time, difflib, optparse
+import sys, os, time, difflib, optparse, mmap, multiprocessing, html, itertools
 from datetime import datetime, timezone
 
+from internal.linediff import ALGORITHMS, LineMatcher, edit_counts, intern_lines
+from internal.mappedlines import MappedLines
+
 
 def file_mtime(path):
     t = datetime.fromtimestamp(os.stat(path).st_mtime,
@@ -18,20 +29,457 @@ def file_mtime(path):
     return t.astimezone().isoformat()
 
 
-def stat_diff(from_lines, to_lines):
-    return None
+def format_range_unified(start, stop):
+    """ lines start..stop as "ed" numbers them in a unified hunk header """
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return '{}'.format(beginning)
+    if not length:
+        # an empty range begins at the line just before it
+        beginning -= 1
+    return '{},{}'.format(beginning, length)
+
+
+def format_range_context(start, stop):
+    """ lines start..stop as "ed" numbers them in a context hunk header """
+    beginning = start + 1
+    length = stop - start
+    if not length:
+        beginning -= 1
+    if length <= 1:
+        return '{}'.format(beginning)
+    return '{},{}'.format(beginning, beginning + length - 1)
+
+
+def unified_diff(a, b, groups, fromfile='', tofile='', fromfiledate='', tofiledate=''):
+    """ the hunks `groups` (grouped opcodes) of lines `a` and `b` as difflib.unified_diff() has them """
+    started = False
+    for group in groups:
+        if not started:
+            started = True
+            fromdate = '\t{}'.format(fromfiledate) if fromfiledate else ''
+            todate = '\t{}'.format(tofiledate) if tofiledate else ''
+            yield '--- {}{}\n'.format(fromfile, fromdate)
+            yield '+++ {}{}\n'.format(tofile, todate)
+        first, last = group[0], group[-1]
+        yield '@@ -{} +{} @@\n'.format(format_range_unified(first[1], last[2]),
+                                      format_range_unified(first[3], last[4]))
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in a[i1:i2]:
+                    yield ' ' + line
+                continue
+            if tag in ('replace', 'delete'):
+                for line in a[i1:i2]:
+                    yield '-' + line
+            if tag in ('replace', 'insert'):
+                for line in b[j1:j2]:
+                    yield '+' + line
+
+
+def context_diff(a, b, groups, fromfile='', tofile='', fromfiledate='', tofiledate=''):
+    """ the hunks `groups` (grouped opcodes) of lines `a` and `b` as difflib.context_diff() has them """
+    prefix = dict(insert='+ ', delete='- ', replace='! ', equal='  ')
+    started = False
+    for group in groups:
+        if not started:
+            started = True
+            fromdate = '\t{}'.format(fromfiledate) if fromfiledate else ''
+            todate = '\t{}'.format(tofiledate) if tofiledate else ''
+            yield '*** {}{}\n'.format(fromfile, fromdate)
+            yield '--- {}{}\n'.format(tofile, todate)
+        first, last = group[0], group[-1]
+        yield '***************\n'
+        yield '*** {} ****\n'.format(format_range_context(first[1], last[2]))
+        if any(tag in ('replace', 'delete') for tag, _, _, _, _ in group):
+            for tag, i1, i2, _, _ in group:
+                if tag != 'insert':
+                    for line in a[i1:i2]:
+                        yield prefix[tag] + line
+        yield '--- {} ----\n'.format(format_range_context(first[3], last[4]))
+        if any(tag in ('replace', 'insert') for tag, _, _, _, _ in group):
+            for tag, _, _, j1, j2 in group:
+                if tag != 'delete':
+                    for line in b[j1:j2]:
+                        yield prefix[tag] + line
+
+
+# columns of the widest +/- bar of a diffstat
+STAT_BAR_WIDTH = 50
+
+
+def scale_bar(count, most):
+    """ `count` of `most` lines as a number of bar columns, at least one for any change """
+    if count == 0 or most <= STAT_BAR_WIDTH:
+        return count
+    return 1 + count * (STAT_BAR_WIDTH - 1) // most
+
+
+def plural(n, word, words):
+    return '{} {}'.format(n, word if n == 1 else words)
+
+
+def format_stat(rows):
+    """
+    the lines of a diffstat of `rows`, [(name, inserted, deleted, changed)], like git diff --stat.
+    rows without a change are left out, nothing at all if none has one
+    """
+    rows = [row for row in rows if row[1] or row[2]]
+    if not rows:
+        return []
+    name_width = max(len(name) for name, _, _, _ in rows)
+    most = max(inserted + deleted for _, inserted, deleted, _ in rows)
+    count_width = len(str(most))
+    lines = []
+    for name, inserted, deleted, changed in rows:
+        total = inserted + deleted
+        plus = scale_bar(inserted, most)
+        minus = scale_bar(deleted, most)
+        if most > STAT_BAR_WIDTH and plus + minus > STAT_BAR_WIDTH:
+            # both rounded up past the width
+            if plus > minus:
+                plus -= 1
+            else:
+                minus -= 1
+        lines.append(' {} | {} {}{}\n'.format(name.ljust(name_width), str(total).rjust(count_width),
+                                               '+' * plus, '-' * minus))
+    inserted = sum(row[1] for row in rows)
+    deleted = sum(row[2] for row in rows)
+    changed = sum(row[3] for row in rows)
+    lines.append(' {} changed, {}(+), {}(-), {} changed\n'.format(
+        plural(len(rows), 'file', 'files'), plural(inserted, 'insertion', 'insertions'),
+        plural(deleted, 'deletion', 'deletions'), plural(changed, 'line', 'lines')))
+    return lines
+
+
+def read_lines(path):
+    """ the lines of `path` as bytes, split the way text mode would """
+    with open(path, 'rb') as fp:
+        return fp.read().splitlines(True)
+
+
+# without -c, unchanged lines shown around every change; longer unchanged runs are collapsed
+HTML_FULL_CONTEXT = 100
+
+# lines longer than this together get no character by character highlights
+INTRALINE_MAX = 2000
+
+HTML_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{fromfile} vs {tofile}</title>
+<style type="text/css">
+    table.diff {{font-family:Courier; border:medium; border-collapse:collapse}}
+    table.diff td {{white-space:pre; vertical-align:top}}
+    .diff_header {{background-color:#e0e0e0}}
+    td.diff_header {{text-align:right; padding:0 4px}}
+    .diff_next {{background-color:#c0c0c0; text-align:center}}
+    .diff_add {{background-color:#aaffaa}}
+    .diff_chg {{background-color:#ffff77}}
+    .diff_sub {{background-color:#ffaaaa}}
+</style>
+</head>
+<body>
+<table class="diff" summary="Legends">
+    <tr><td class="diff_add">&nbsp;Added&nbsp;</td><td class="diff_chg">Changed</td><td class="diff_sub">Deleted</td></tr>
+</table>
+<table class="diff" rules="groups">
+<thead><tr><th class="diff_header" colspan="2">{fromfile}</th><th class="diff_header" colspan="2">{tofile}</th></tr></thead>
+<tbody>
+"""
+
+HTML_TAIL = """</tbody>
+</table>
+</body>
+</html>
+"""
+
+HTML_ROW = '<tr><td class="diff_header">{}</td><td>{}</td><td class="diff_header">{}</td><td>{}</td></tr>\n'
+
+HTML_NOTE = '<tr><td class="diff_next" colspan="4">{}</td></tr>\n'
+
+
+def html_text(line, kind=None):
+    text = html.escape(line.rstrip('\r\n'), quote=False)
+    return '<span class="{}">{}</span>'.format(kind, text) if kind and text else text
+
+
+def html_changed(x, y):
+    """ lines `x` and `y` as HTML, the characters that differ highlighted """
+    x, y = x.rstrip('\r\n'), y.rstrip('\r\n')
+    if len(x) + len(y) > INTRALINE_MAX:
+        return html_text(x, 'diff_chg'), html_text(y, 'diff_chg')
+    left = []
+    right = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, x, y, autojunk=False).get_opcodes():
+        kind = None if tag == 'equal' else 'diff_chg'
+        left.append(html_text(x[i1:i2], kind))
+        right.append(html_text(y[j1:j2], kind))
+    return ''.join(left), ''.join(right)
+
+
+def html_rows(a, b, tag, i1, i2, j1, j2):
+    """ the table rows of one opcode, lines of both sides next to each other """
+    pairs = itertools.zip_longest(range(i1, i2), a[i1:i2], range(j1, j2), b[j1:j2])
+    for i, x, j, y in pairs:
+        if tag == 'equal':
+            left, right = html_text(x), html_text(y)
+        elif x is not None and y is not None:
+            left, right = html_changed(x, y)
+        else:
+            left = '' if x is None else html_text(x, 'diff_sub')
+            right = '' if y is None else html_text(y, 'diff_add')
+        yield HTML_ROW.format('' if i is None else i + 1, left, '' if j is None else j + 1, right)
+
+
+def html_skipped(count):
+    return HTML_NOTE.format('&#8943; {} unchanged {} &#8943;'.format(count, 'line' if count == 1 else 'lines'))
+
+
+def html_diff(a, b, groups, fromfile, tofile):
+    """
+    an HTML page of lines `a` and `b` side by side, given a hunk (of grouped opcodes) at a time,
+    so nothing is held but the row being written. the unchanged lines between hunks are one row
+    """
+    yield HTML_HEAD.format(fromfile=html.escape(fromfile), tofile=html.escape(tofile))
+    i_end = 0
+    changed = False
+    for group in groups:
+        changed = True
+        if group[0][1] > i_end:
+            yield html_skipped(group[0][1] - i_end)
+        for opcode in group:
+            yield from html_rows(a, b, *opcode)
+        i_end = group[-1][2]
+    if not changed:
+        yield HTML_NOTE.format('No differences found')
+    if len(a) > i_end:
+        yield html_skipped(len(a) - i_end)
+    yield HTML_TAIL
+
+
+def html_context(options):
+    """ the lines of context of -m: -l of them with -c, all but huge unchanged runs without """
+    return options.lines if options.c else HTML_FULL_CONTEXT
+
+
+def line_algorithm(options):
+    """
+    the engine of -s, -m and --mmap, which don't run difflib: histogram, but myers for --mmap,
+    it's the one whose working set stays in arrays, the others count the lines in dicts
+    """
+    if options.algorithm != "difflib":
+        return options.algorithm
+    return "myers" if options.mmap else "histogram"
+
+
+def stat_row(fromfile, tofile, algorithm="histogram", name=None, mapped=False):
+    """
+    (name, inserted, deleted, changed) of two files: only the edit counts of their lines, told
+    apart by their hashes in a memory map if `mapped`
+    """
+    if mapped:
+        a, b = MappedLines(fromfile), MappedLines(tofile)
+        try:
+            counts = edit_counts(a.hashes, b.hashes, algorithm=algorithm)
+        finally:
+            a.close()
+            b.close()
+    else:
+        counts = edit_counts(*intern_lines(read_lines(fromfile), read_lines(tofile)), algorithm=algorithm)
+    if name is None:
+        name = tofile if fromfile == tofile else '{} => {}'.format(fromfile, tofile)
+    return (name,) + counts
+
+
+def stat_diff(fromfile, tofile, algorithm="histogram", mapped=False):
+    """ a diffstat of two files, no hunk is ever made """
+    return format_stat([stat_row(fromfile, tofile, algorithm, mapped=mapped)])
+
+
+def mapped_diff(fromfile, tofile, options):
+    """
+    the context, unified or HTML diff of two files mapped into memory, only the lines printed
+    are ever decoded. the maps are closed once it's all taken
+    """
+    a, b = MappedLines(fromfile), MappedLines(tofile)
+    try:
+        matcher = LineMatcher(a.hashes, b.hashes, line_algorithm(options))
+        fromdate = file_mtime(fromfile)
+        todate = file_mtime(tofile)
+        if options.u:
+            yield from unified_diff(a, b, matcher.get_grouped_opcodes(options.lines),
+                                    fromfile, tofile, fromdate, todate)
+        elif options.m:
+            yield from html_diff(a, b, matcher.get_grouped_opcodes(html_context(options)), fromfile, tofile)
+        else:
+            yield from context_diff(a, b, matcher.get_grouped_opcodes(options.lines),
+                                    fromfile, tofile, fromdate, todate)
+    finally:
+        a.close()
+        b.close()
+
+
+def file_diff(fromfile, tofile, options):
+    """ the diff of two files in the format `options` ask for, an iterable of lines """
+    if options.mmap:
+        return mapped_diff(fromfile, tofile, options)
+    n = options.lines
+    fromdate = file_mtime(fromfile)
+    todate = file_mtime(tofile)
+    with open(fromfile) as ff:
+        fromlines = ff.readlines()
+    with open(tofile) as tf:
+        tolines = tf.readlines()
+
+    if options.algorithm != "difflib" and not (options.n or options.m):
+        # lines as interned ids, SequenceMatcher never sees them
+        matcher = LineMatcher(*intern_lines(fromlines, tolines), algorithm=options.algorithm)
+        groups = matcher.get_grouped_opcodes(n)
+        if options.u:
+            return unified_diff(fromlines, tolines, groups, fromfile, tofile, fromdate, todate)
+        return context_diff(fromlines, tolines, groups, fromfile, tofile, fromdate, todate)
+    if options.u:
+        return difflib.unified_diff(fromlines, tolines, fromfile, tofile, fromdate, todate, n=n)
+    if options.n:
+        return difflib.ndiff(fromlines, tolines)
+    if options.m:
+        # rows are written as they're made, HtmlDiff builds the whole page in memory first
+        matcher = LineMatcher(*intern_lines(fromlines, tolines), algorithm=line_algorithm(options))
+        return html_diff(fromlines, tolines, matcher.get_grouped_opcodes(html_context(options)), fromfile, tofile)
+    return difflib.context_diff(fromlines, tolines, fromfile, tofile, fromdate, todate, n=n)
+
+
+# bytes compared at a time by same_content(), and looked at for a NUL by is_binary()
+COMPARE_CHUNK = 1 << 20
+BINARY_PROBE = 1 << 13
+
+
+def same_content(path1, path2):
+    """ whether two files of the same size are byte for byte equal, a mapped chunk at a time """
+    with open(path1, 'rb') as f1, open(path2, 'rb') as f2:
+        size = os.fstat(f1.fileno()).st_size
+        if size != os.fstat(f2.fileno()).st_size:
+            return False
+        if size == 0:
+            return True
+        with mmap.mmap(f1.fileno(), 0, access=mmap.ACCESS_READ) as m1, \
+                mmap.mmap(f2.fileno(), 0, access=mmap.ACCESS_READ) as m2:
+            for pos in range(0, size, COMPARE_CHUNK):
+                if m1[pos:pos + COMPARE_CHUNK] != m2[pos:pos + COMPARE_CHUNK]:
+                    return False
+    return True
+
+
+def is_binary(path):
+    with open(path, 'rb') as fp:
+        return b'\0' in fp.read(BINARY_PROBE)
+
+
+def walk_pair(dir1, dir2):
+    """
+    yield what comparing the trees `dir1` and `dir2` takes, in name order like diff -r: a
+    message (str) for an entry on one side only or of another kind on each, or (path1, path2,
+    maybe_same) for a file on both sides, `maybe_same` when their sizes are equal
+    """
+    def entries(path):
+        with os.scandir(path) as it:
+            return {entry.name: entry for entry in it}
+
+    left, right = entries(dir1), entries(dir2)
+    for name in sorted(set(left) | set(right)):
+        if name not in right:
+            yield 'Only in {}: {}\n'.format(dir1, name)
+            continue
+        if name not in left:
+            yield 'Only in {}: {}\n'.format(dir2, name)
+            continue
+        e1, e2 = left[name], right[name]
+        if e1.is_dir() and e2.is_dir():
+            yield from walk_pair(e1.path, e2.path)
+        elif e1.is_file() and e2.is_file():
+            yield e1.path, e2.path, e1.stat().st_size == e2.stat().st_size
+        elif e1.is_dir() or e2.is_dir():
+            kinds = ('directory' if e.is_dir() else 'regular file' for e in (e1, e2))
+            yield 'File {} is a {} while file {} is a {}\n'.format(e1.path, next(kinds), e2.path, next(kinds))
+
+
+def diff_pair(item, options):
+    """
+    (lines to print, diffstat row or None) of one thing walk_pair() gives. files of equal size
+    are compared byte for byte before any of them is read as lines
+    """
+    if isinstance(item, str):
+        return [item], None
+    path1, path2, maybe_same = item
+    if maybe_same and same_content(path1, path2):
+        return [], None
+    if is_binary(path1) or is_binary(path2):
+        return ['Binary files {} and {} differ\n'.format(path1, path2)], None
+    if options.s:
+        return [], stat_row(path1, path2, line_algorithm(options), name=path2, mapped=options.mmap)
+    try:
+        lines = list(file_diff(path1, path2, options))
+    except UnicodeDecodeError:
+        return ['Binary files {} and {} differ\n'.format(path1, path2)], None
+    if lines:
+        lines.insert(0, 'diff -r {} {}\n'.format(path1, path2))
+    return lines, None
+
+
+def _init_worker(options):
+    global _worker_options
+    _worker_options = options
+
+
+def _diff_worker(item):
+    return diff_pair(item, _worker_options)
+
+
+POOL_CHUNK = 16
+
+
+def diff_dirs(dir1, dir2, options, jobs=1):
+    """ print the differences of two trees, the files diffed on a pool of `jobs` processes """
+    rows = []
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, _init_worker, (options,))
+        # in walk order, while the workers go on with the next ones
+        results = pool.imap(_diff_worker, walk_pair(dir1, dir2), POOL_CHUNK)
+    else:
+        pool = None
+        results = (diff_pair(item, options) for item in walk_pair(dir1, dir2))
+    try:
+        for lines, row in results:
+            sys.stdout.writelines(lines)
+            if row is not None:
+                rows.append(row)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    sys.stdout.writelines(format_stat(rows))
 
 
 def main():
 
-    usage = "usage: %prog [options] fromfile tofile"
+    usage = "usage: %prog [options] fromfile tofile\n       %prog -r [options] fromdir todir"
     parser = optparse.OptionParser(usage)
     parser.add_option("-c", action="store_true", default=False, help='Produce a context format diff (default)')
     parser.add_option("-u", action="store_true", default=False, help='Produce a unified format diff')
-    parser.add_option("-m", action="store_true", default=False, help='Produce HTML side by side diff (can use -c and -l in conjunction)')
+    parser.add_option("-m", action="store_true", default=False, help='Produce HTML side by side diff, written as it goes (can use -c and -l in conjunction)')
     parser.add_option("-n", action="store_true", default=False, help='Produce a ndiff format diff')
-    parser.add_option("-s", action="store_true", default=False, help='Statistic difference Produce a ndiff format diff')
+    parser.add_option("-s", action="store_true", default=False, help='Produce a diffstat: lines inserted, deleted and changed, with a +/- bar')
     parser.add_option("-l", "--lines", type="int", default=3, help='Set number of context lines (default 3)')
+    parser.add_option("--algorithm", choices=("difflib",) + ALGORITHMS, default="difflib",
+                      help='Diff engine of the context and unified formats: difflib (default), ' + ', '.join(ALGORITHMS) +
+                           '. -s and -m use histogram, --mmap myers, unless another one is given')
+    parser.add_option("-r", action="store_true", default=False, help='Compare two directories, recursively')
+    parser.add_option("-j", "--jobs", type="int", default=1, help='Diff files of -r on this many processes, 0 for one per CPU (default 1)')
+    parser.add_option("--mmap", action="store_true", default=False,
+                      help='Memory-map both files and keep only where lines start and their hashes, for files '
+                           'larger than memory (all formats but -n)')
     (options, args) = parser.parse_args()
 
     if len(args) == 0:
@@ -40,28 +488,24 @@ def main():
     if len(args) != 2:
         parser.error("need to specify both a fromfile and tofile")
 
-    n = options.lines
     fromfile, tofile = args
+    if options.mmap and options.n:
+        parser.error("--mmap can't be used with -n")
 
-    fromdate = file_mtime(fromfile)
-    todate = file_mtime(tofile)
-    with open(fromfile) as ff:
-        fromlines = ff.readlines()
-    with open(tofile) as tf:
-        tolines = tf.readlines()
+    if options.r:
+        if options.m:
+            parser.error("-m can't be used with -r")
+        if not (os.path.isdir(fromfile) and os.path.isdir(tofile)):
+            parser.error("-r needs two directories")
+        jobs = options.jobs if options.jobs > 0 else (os.cpu_count() or 1)
+        diff_dirs(fromfile, tofile, options, jobs)
+        return
 
-    if options.u:
-        diff = difflib.unified_diff(fromlines, tolines, fromfile, tofile, fromdate, todate, n=n)
-    elif options.n:
-        diff = difflib.ndiff(fromlines, tolines)
-    elif options.m:
-        diff = difflib.HtmlDiff().make_file(fromlines,tolines,fromfile,tofile,context=options.c,numlines=n)
-    elif options.s:
-        diff = stat_diff(fromlines, tolines)
-    else:
-        diff = difflib.context_diff(fromlines, tolines, fromfile, tofile, fromdate, todate, n=n)
+    if options.s:
+        sys.stdout.writelines(stat_diff(fromfile, tofile, line_algorithm(options), options.mmap))
+        return
 
-    sys.stdout.writelines(diff)
+    sys.stdout.writelines(file_diff(fromfile, tofile, options))
 
 
 if __name__ == '__main__':
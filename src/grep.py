@@ -7,9 +7,26 @@ __author__ = 'zaopuppy'
 import sys
 import re
 import getopt
+import codecs
+import collections
+import fnmatch
+import io
+import mmap
+import multiprocessing
 
+import os
 import os.path
 
+from concurrent.futures import ThreadPoolExecutor
+
+from internal.trigram import INDEX_FILE_NAME, TrigramIndex, IndexFilter, IndexFormatError, trigrams
+
+try:
+    # python 3.11+, `sre_parse` is deprecated there
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
 
 try:
     import readline
@@ -25,51 +42,934 @@ if sys.version_info.major != 3:
 
 def usage():
     print("""
-    <grep> <pattern> files
+    <grep> [-i] [-F] [-l|-c|-q] [-m N] [-A N] [-B N] [-C N] [-a|-I|--binary-files=TYPE] [-j N] [-r|-R] [--include=GLOB] [--exclude=GLOB] [--exclude-dir=GLOB] <pattern> files
+    <grep> [options] -e <pattern> [-e <pattern> ...] files
+    <grep> [options] -f <pattern file> files
+    <grep> --index=DIR                          build or update the trigram index of DIR
+    <grep> --index=DIR [options] <pattern> [files]  search DIR (or files) with the help of it
     """)
 
 
-def main():
-    optlist, args = getopt.getopt(sys.argv[1:], "i", "ignore-case=")
+def map_file(fp):
+    """ map the whole file read-only, empty files can't be mapped so they get an empty buffer """
+    if os.fstat(fp.fileno()).st_size == 0:
+        return b''
+    return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def count_lines(buf, start, end, block=1 << 20):
+    """ count '\n' in buf[start:end], mmap has no `count()` before python 3.13, so count a slice at a time """
+    n = 0
+    while start < end:
+        stop = min(start + block, end)
+        n += buf[start:stop].count(b'\n')
+        start = stop
+    return n
+
+
+# how much of the start of a file is looked at to tell binary files from text ones
+BINARY_PROBE = 1 << 15
+
+
+def is_binary(buf):
+    """ a NUL in the first block means a binary file, like GNU grep """
+    return buf.find(b'\0', 0, BINARY_PROBE) >= 0
+
+
+def required_literals(pattern, flag=0, fold_case=False):
+    """
+    the literal byte strings every match of the bytes regex `pattern` has to contain,
+    empty if there is none we can rely on (case insensitive parts, alternations, ...).
+    with `fold_case` the case insensitive parts count too, for a caller that lower cases everything
+    """
+    parsed = sre_parse.parse(pattern, flag)
+    if parsed.state.flags & re.IGNORECASE and not fold_case:
+        return []
+    literals = []
+    _collect_literals(parsed, literals, fold_case)
+    return literals
+
+
+_REPEATS = tuple(getattr(sre_parse, name) for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+                 if hasattr(sre_parse, name))
+
+
+def _collect_literals(parsed, literals, fold_case=False):
+    run = bytearray()
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            run.append(av)
+            continue
+        if run:
+            literals.append(bytes(run))
+            run = bytearray()
+        if op is sre_parse.SUBPATTERN:
+            # (group, add_flags, del_flags, pattern)
+            if fold_case or not av[1] & re.IGNORECASE:
+                _collect_literals(av[-1], literals, fold_case)
+        elif op in _REPEATS and av[0] >= 1:
+            # (min, max, pattern)
+            _collect_literals(av[2], literals, fold_case)
+    if run:
+        literals.append(bytes(run))
+
+
+def trie_pattern(words):
+    """
+    build one bytes regex matching any of `words`, shaped as a trie, so the regex engine
+    walks all words in a single pass instead of trying them one after another
+    """
+    trie = {}
+    for w in words:
+        node = trie
+        for b in w:
+            node = node.setdefault(b, {})
+        # end of a word
+        node[None] = None
+    return _trie_regex(trie)
+
+
+def _trie_chain(b, node):
+    """ (the bytes from `b` on down to where words branch or end, the node there) """
+    run = bytearray([b])
+    while len(node) == 1 and None not in node:
+        (b, node), = node.items()
+        run.append(b)
+    return bytes(run), node
+
+
+def _trie_regex(trie):
+    """
+    the regex of `trie`, every node's made after its children's off a stack, not by recursion:
+    a word can be longer than the recursion limit. a run without branches is one escaped literal
+    """
+    regexes = {}
+    stack = [(trie, None)]
+    while stack:
+        node, chains = stack.pop()
+        if chains is None:
+            chains = [_trie_chain(b, child) for b, child in sorted(
+                (item for item in node.items() if item[0] is not None))]
+            stack.append((node, chains))
+            stack.extend((child, None) for _, child in chains)
+            continue
+        branches = [re.escape(run) + regexes.pop(id(child)) for run, child in chains]
+        if not branches:
+            result = b''
+        elif len(branches) == 1 and None not in node:
+            result = branches[0]
+        else:
+            result = b'(?:' + b'|'.join(branches) + b')'
+            if None in node:
+                # a word ends here, the rest is optional
+                result += b'?'
+        regexes[id(node)] = result
+    return regexes[id(trie)]
+
+
+class RegexMatcher():
+    """
+    run a compiled bytes regex, when there is a literal every match must contain, `bytes.find`
+    skips to it first and the regex only runs over the line around it
+    """
+    def __init__(self, prog, literal=None):
+        self.prog = prog
+        self.literal = literal
+
+    def find(self, buf, pos, end):
+        """ return (start, end) of the first match in buf[pos:end], or None """
+        if self.literal is None:
+            m = self.prog.search(buf, pos, end)
+            return None if m is None else m.span()
+        while pos < end:
+            i = buf.find(self.literal, pos, end)
+            if i < 0:
+                return None
+            line_start = buf.rfind(b'\n', pos, i) + 1 or pos
+            line_end = buf.find(b'\n', i, end)
+            line_end = end if line_end < 0 else line_end + 1
+            m = self.prog.search(buf, line_start, line_end)
+            if m is not None:
+                return m.span()
+            pos = line_end
+        return None
+
+
+class FixedMatcher():
+    """ a single fixed string, `bytes.find` does all the work """
+    def __init__(self, word):
+        self.word = word
+
+    def find(self, buf, pos, end):
+        i = buf.find(self.word, pos, end)
+        return None if i < 0 else (i, i + len(self.word))
+
+
+def make_matcher(patterns, flag=0, fixed=False):
+    """ compile all patterns into one matcher, files are searched as bytes """
+    patterns = [os.fsencode(p) if isinstance(p, str) else p for p in patterns]
+    # `^` and `$` have to work at every line inside the buffer
+    flag |= re.MULTILINE
+    if fixed:
+        if len(patterns) == 1 and not flag & re.IGNORECASE:
+            return FixedMatcher(patterns[0])
+        try:
+            return RegexMatcher(re.compile(trie_pattern(patterns), flag))
+        except RecursionError:
+            # words that are prefixes of each other nest groups deeper than `re` parses them,
+            # the longest of the words that match at a position is taken first all the same
+            words = sorted(patterns, key=len, reverse=True)
+            return RegexMatcher(re.compile(b'|'.join(re.escape(w) for w in words), flag))
+    if len(patterns) == 0:
+        # nothing to look for, nothing matches
+        return RegexMatcher(re.compile(b'(?!)', flag))
+    if len(patterns) == 1:
+        pattern = patterns[0]
+    else:
+        pattern = b'|'.join(b'(?:' + p + b')' for p in patterns)
+    prog = re.compile(pattern, flag)
+    literals = required_literals(pattern, flag)
+    if flag & re.IGNORECASE:
+        # `bytes.find` is case sensitive, only literals without letters can be used then
+        literals = [lit for lit in literals if lit.lower() == lit.upper()]
+    # the longest one is the rarest, most likely
+    literal = max(literals, key=len) if literals else None
+    return RegexMatcher(prog, literal)
+
+
+def index_query(patterns, fixed=False):
+    """ the trigrams every match of each pattern must contain, see TrigramIndex.candidate_ids() """
+    query = []
+    for p in patterns:
+        p = os.fsencode(p) if isinstance(p, str) else p
+        literals = [p] if fixed else required_literals(p, fold_case=True)
+        query.append(set().union(*(trigrams(lit) for lit in literals)))
+    return query
+
+
+def after_last_line(buf, pos, end):
+    """ whether `pos` is the empty position after the '\n' that ends buf[:end], no line starts there """
+    return pos == end and end > 0 and buf[end - 1] == ord('\n')
+
+
+def line_matches(buf, matcher, start, end):
+    """
+    whether `matcher` matches the line buf[start:end]. like GNU grep, the line is searched
+    without its '\n': `\\s` can't match it and `$` matches right before it. the empty position
+    after the last '\n' isn't a line
+    """
+    if after_last_line(buf, start, end):
+        return False
+    if end > start and buf[end - 1] == ord('\n'):
+        end -= 1
+    return matcher.find(buf, start, end) is not None
+
+
+def search_lines(buf, matcher, start=0, end=None):
+    """
+    yield (line_no, line_start, line_end) of every line in buf[start:end] that `matcher` matches,
+    `line_end` points past the line's '\n' (if any), line numbers start from 0.
+
+    the pattern runs over the whole buffer, line boundaries are only looked up around matches
+    """
+    if end is None:
+        end = len(buf)
+    pos = start
+    no = 0
+    counted = start
+    while pos < end:
+        m = matcher.find(buf, pos, end)
+        if m is None:
+            break
+        match_start, match_end = m
+        if after_last_line(buf, match_start, end):
+            # an empty match after the last '\n' isn't a line
+            break
+        line_start = buf.rfind(b'\n', pos, match_start) + 1 or pos
+        line_end = buf.find(b'\n', match_start, end)
+        line_end = end if line_end < 0 else line_end + 1
+        # a match that takes the line's '\n' or runs past it (`\s`, `[^x]`, ...) has to be
+        # confirmed inside the line alone
+        if match_end >= line_end and not line_matches(buf, matcher, line_start, line_end):
+            pos = line_end
+            continue
+        no += count_lines(buf, counted, line_start)
+        counted = line_start
+        yield no, line_start, line_end
+        pos = line_end
+
+
+def add_context(buf, matcher, matches, before, after, done=0, limit=None):
+    """
+    yield (line_no, line_start, line_end, is_match) for `matches` from search_lines() and up to
+    `before`/`after` lines around each of them, in order and every line once.
+
+    the lines before a match are found by walking back from it, and the lines after it are
+    checked one by one as they are passed (a matching one starts the count again), so memory
+    stays constant whatever the size of the buffer.
+
+    lines before offset `done` have been yielded by the caller already. with `limit`, the lines
+    after a match end at the first matching one from `limit` on, the caller searches it later
+    """
+    size = len(buf)
+    for no, line_start, line_end in matches:
+        if line_start < done:
+            # yielded as a match while going through the lines after the previous one
+            continue
+        # a ring of the line offsets before the match, and the match's own
+        starts = collections.deque(maxlen=before + 1)
+        p = line_start
+        while len(starts) < before and p > done:
+            i = buf.rfind(b'\n', done, p - 1)
+            p = done if i < 0 else i + 1
+            starts.appendleft(p)
+        starts.append(line_start)
+        for k in range(len(starts) - 1):
+            yield no - len(starts) + 1 + k, starts[k], starts[k + 1], False
+        yield no, line_start, line_end, True
+
+        p = line_end
+        left = after
+        while left > 0 and p < size:
+            e = buf.find(b'\n', p)
+            e = size if e < 0 else e + 1
+            if line_matches(buf, matcher, p, e):
+                if limit is not None and p >= limit:
+                    break
+                no += 1
+                yield no, p, e, True
+                left = after
+            else:
+                no += 1
+                yield no, p, e, False
+                left -= 1
+            p = e
+        done = p
+
+
+# stdin is read this much at a time
+STDIN_BLOCK = 1 << 20
+
+
+def search_stream(fp, matcher, before=0, after=0, data=b''):
+    """
+    yield (line_no, line, is_match) for a binary stream (stdin) like search_file() does for a
+    file, `data` is what has been read from it already.
+
+    the stream is read in large blocks and all the complete lines of a block are searched at
+    once. kept from one block to the next: up to `before` lines that may be wanted as context,
+    the last `after` lines (a match before them needs them as context, so they're searched with
+    the next block), and the unfinished last line
+    """
+    buf = b''
+    # buf[searched:] hasn't been searched, buf[done:] hasn't been yielded
+    searched = 0
+    done = 0
+    # line number of buf[searched]
+    base = 0
+    eof = False
+    while not eof:
+        if not data:
+            data = fp.read1(STDIN_BLOCK)
+            eof = not data
+        buf += data
+        data = b''
+        complete = len(buf) if eof else buf.rfind(b'\n') + 1
+        end = complete
+        if not eof:
+            for _ in range(after):
+                if end <= searched:
+                    break
+                i = buf.rfind(b'\n', searched, end - 1)
+                end = searched if i < 0 else i + 1
+            if end <= searched:
+                continue
+
+        lines = buf[:complete]
+        matches = search_lines(lines, matcher, searched, end)
+        if before or after:
+            matches = add_context(lines, matcher, matches, before, after, done, None if eof else end)
+        else:
+            matches = ((no, s, e, True) for no, s, e in matches)
+        for no, s, e, is_match in matches:
+            yield base + no, lines[s:e], is_match
+            done = e
+        base += count_lines(lines, searched, end)
+        searched = end
+
+        # drop everything but the `before` lines in front of what's left to search
+        keep = searched
+        for _ in range(before):
+            if keep <= 0:
+                break
+            i = buf.rfind(b'\n', 0, keep - 1)
+            keep = 0 if i < 0 else i + 1
+        buf = buf[keep:]
+        searched -= keep
+        done = max(done - keep, 0)
+
+
+class GrepOptions():
+    """ what to report about the matches, it goes to the workers too """
+    def __init__(self):
+        # -c, only count matching lines
+        self.count = False
+        # -l, only name the files with a match
+        self.list_files = False
+        # -q, nothing but the exit status
+        self.quiet = False
+        # -m, stop reading a file after that many matching lines
+        self.max_count = None
+        # -B/-A, lines of context before and after each match
+        self.before = 0
+        self.after = 0
+        # --binary-files, "binary": only say whether a binary file matches,
+        # "without-match": skip binary files, "text": search them like text
+        self.binary_files = "binary"
+
+    def stop_at(self):
+        """ how many matching lines are enough for one file, None for all of them """
+        if self.quiet or self.list_files:
+            return 1
+        return self.max_count
+
+    def context(self):
+        """ (before, after), no context when the lines aren't printed """
+        if self.quiet or self.list_files or self.count:
+            return 0, 0
+        return self.before, self.after
+
+
+class Output():
+    """
+    one big buffered binary writer for all the output, so we don't pay a write per matching line
+    (every `print()` is a separate write on win32 consoles and pipes)
+    """
+    def __init__(self, stream=None, size=1 << 16):
+        self.stream = stream if stream is not None else sys.stdout.buffer
+        self.size = size
+        self.buf = bytearray()
+        # files are searched as utf-8 bytes and written through untouched, unless the console
+        # wants something else (cp936 on a chinese win32, ...). the decoder keeps what's left of
+        # a character cut by a flush for the next one
+        encoding = getattr(sys.stdout, "encoding", None) or "utf-8"
+        self.decoder = None
+        self.encoder = None
+        if codecs.lookup(encoding).name != "utf-8":
+            self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            self.encoder = codecs.getincrementalencoder(encoding)(errors="replace")
+
+    def write(self, data):
+        self.buf += data
+        if len(self.buf) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.buf:
+            data = self.buf
+            if self.decoder is not None:
+                data = self.encoder.encode(self.decoder.decode(data))
+            self.stream.write(data)
+            self.buf = bytearray()
+        self.stream.flush()
 
-    if len(args) <= 0:
-        usage()
+
+def format_line(name, no, line, is_match=True):
+    # matches as `name:no: line`, context as `name-no- line`
+    sep = b":" if is_match else b"-"
+    return b"%s%s%d%s %s" % (name, sep, no, sep, line)
+
+
+# between groups of lines that aren't next to each other
+SEPARATOR = b"--\n"
+
+
+def format_count(name, n):
+    return b"%s:%d\n" % (name, n)
+
+
+def report(name, lines, options, out):
+    """
+    write what `options` asks for about `lines`, an iterator of (line_no, line, is_match),
+    `name` is None for stdin, whose lines are written bare. return the number of matching lines,
+    reading stops as soon as it's known
+    """
+    stop_at = options.stop_at()
+    if stop_at == 0:
+        # -m 0, not a line is read
+        return 0
+    show_lines = not (options.quiet or options.list_files or options.count)
+    before, after = options.context()
+    n = 0
+    # context lines after the last match we want
+    trailing = 0
+    last_no = None
+    for no, line, is_match in lines:
+        if n == stop_at:
+            # past the last match we want, whatever follows is only context
+            trailing += 1
+            is_match = False
+        elif is_match:
+            n += 1
+        if show_lines:
+            if (before or after) and last_no is not None and no > last_no + 1:
+                out.write(SEPARATOR)
+            last_no = no
+            out.write(line if name is None else format_line(name, no, line, is_match))
+        if n == stop_at and trailing >= after:
+            break
+    if options.quiet:
+        return n
+    label = b"(standard input)" if name is None else name
+    if options.list_files:
+        if n > 0:
+            out.write(label + b"\n")
+    elif options.count:
+        out.write(format_count(name, n) if name is not None else b"%d\n" % n)
+    return n
+
+
+def search_file(buf, matcher, options, start=0, end=None):
+    """ search_lines() with the context `options` asks for, yield (line_no, line_start, line_end, is_match) """
+    before, after = options.context()
+    matches = search_lines(buf, matcher, start, end)
+    if before == 0 and after == 0:
+        return ((no, s, e, True) for no, s, e in matches)
+    return add_context(buf, matcher, matches, before, after)
+
+
+def grep_binary(name, matches, options, out):
+    """
+    a binary file is never printed, the first of `matches` (line_no first) is enough to say
+    it matches. `name` is None for stdin
+    """
+    if options.binary_files == "without-match" or options.stop_at() == 0:
+        return 0
+    if options.quiet or options.list_files or options.count:
+        return report(name, ((m[0], None, True) for m in matches), options, out)
+    for _ in matches:
+        out.write(b"Binary file %s matches\n" % (b"(standard input)" if name is None else name))
         return 1
+    return 0
+
+
+def grep_stdin(matcher, options, out):
+    """ search stdin, return the number of matching lines """
+    fp = sys.stdin.buffer
+    data = fp.read1(STDIN_BLOCK)
+    if options.binary_files != "text" and is_binary(data):
+        return grep_binary(None, search_stream(fp, matcher, data=data), options, out)
+    return report(None, search_stream(fp, matcher, *options.context(), data=data), options, out)
+
+
+def grep_file(f, matcher, options, out):
+    """ search one file, return the number of matching lines """
+    if not os.path.isfile(f):
+        out.write(b"%s: not a file\n" % os.fsencode(f))
+        return 0
+    try:
+        with open(f, "rb") as fp:
+            buf = map_file(fp)
+            try:
+                if options.binary_files != "text" and is_binary(buf):
+                    return grep_binary(os.fsencode(f), search_lines(buf, matcher), options, out)
+                lines = search_file(buf, matcher, options)
+                return report(os.fsencode(f), ((no, buf[s:e], m) for no, s, e, m in lines), options, out)
+            finally:
+                if isinstance(buf, mmap.mmap):
+                    buf.close()
+    except Exception as e:
+        out.write(b"%s\n" % str(e).encode(errors="replace"))
+        return 0
+
+
+def line_start_at(buf, pos):
+    """ the start of the first line beginning at or after `pos` """
+    if pos <= 0:
+        return 0
+    if pos >= len(buf):
+        return len(buf)
+    i = buf.find(b'\n', pos - 1)
+    return len(buf) if i < 0 else i + 1
+
+
+def grep_chunk(f, matcher, options, start, end):
+    """
+    search the lines of `f` that begin inside [start, end), a byte range of a big file.
+
+    neighbouring chunks pick the same line boundaries near the split point on their own, so
+    every line is searched exactly once. return (lines, n, newlines), `lines` holds
+    (line_no, line, is_match) with line numbers counted from the chunk's first line (left empty
+    for -c), `newlines` is the number of '\n' in the chunk, so the caller can number the next chunk.
+
+    context lines may reach into the neighbouring chunks, the caller drops the ones it has already
+    """
+    with open(f, "rb") as fp:
+        buf = map_file(fp)
+        try:
+            start = line_start_at(buf, start)
+            end = line_start_at(buf, end)
+            lines = []
+            n = 0
+            # a line number we know the offset of
+            no = 0
+            counted = start
+            for line_no, line_start, line_end, is_match in search_file(buf, matcher, options, start, end):
+                if start <= line_start < end:
+                    no = line_no
+                    counted = line_start
+                    if is_match:
+                        n += 1
+                if not options.count:
+                    lines.append((line_no, buf[line_start:line_end], is_match))
+            # the lines up to the last one we've seen are counted already
+            return lines, n, no + count_lines(buf, counted, end)
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+
+class DirWalker():
+    """
+    list the files under directories in depth-first order.
+
+    the sub-directories of a directory are listed ahead of time on a thread pool, so
+    enumeration overlaps with searching, and excluded sub-directories are pruned before
+    anyone lists them
+    """
+    def __init__(self, follow_links=False, include=(), exclude=(), exclude_dir=(), threads=4):
+        self.follow_links = follow_links
+        self.include = include
+        self.exclude = exclude
+        self.exclude_dir = exclude_dir
+        self.threads = threads
+
+    def match_file(self, name):
+        if self.include and not any(fnmatch.fnmatch(name, p) for p in self.include):
+            return False
+        return not any(fnmatch.fnmatch(name, p) for p in self.exclude)
+
+    def match_dir(self, name):
+        return not any(fnmatch.fnmatch(name, p) for p in self.exclude_dir)
+
+    def scan(self, d):
+        """ return (files, dirs, error) of one directory """
+        files = []
+        dirs = []
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    if not self.follow_links and entry.is_symlink():
+                        continue
+                    if entry.is_dir():
+                        if self.match_dir(entry.name):
+                            dirs.append(entry.path)
+                    elif entry.name == INDEX_FILE_NAME:
+                        # the trigram index isn't part of the tree it indexes
+                        continue
+                    elif self.match_file(entry.name):
+                        files.append(entry.path)
+        except OSError as e:
+            return files, dirs, e
+        return files, dirs, None
+
+    def walk(self, top):
+        executor = ThreadPoolExecutor(self.threads)
+        # with -R a symbolic link may lead back to a directory we are in
+        visited = set()
+        try:
+            stack = [iter([executor.submit(self.scan, top)])]
+            while stack:
+                future = next(stack[-1], None)
+                if future is None:
+                    stack.pop()
+                    continue
+                files, dirs, error = future.result()
+                if error is not None:
+                    print(error, file=sys.stderr)
+                yield from files
+                if self.follow_links:
+                    dirs = [d for d in dirs if self._first_visit(d, visited)]
+                if dirs:
+                    stack.append(iter([executor.submit(self.scan, d) for d in dirs]))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _first_visit(d, visited):
+        try:
+            st = os.stat(d)
+        except OSError:
+            return False
+        key = (st.st_dev, st.st_ino)
+        if key in visited:
+            return False
+        visited.add(key)
+        return True
+
+
+def iter_files(file_list, walker):
+    """ expand the directories in `file_list` when searching recursively """
+    for f in file_list:
+        if walker is not None and os.path.isdir(f):
+            yield from walker.walk(f)
+        else:
+            yield f
+
+
+# files bigger than this are split into chunks of this size, so several workers share them
+CHUNK_SIZE = 64 << 20
+
+
+def probe_binary(f):
+    """ read the first block of `f` to tell whether it's binary """
+    try:
+        with open(f, "rb") as fp:
+            return is_binary(fp.read(BINARY_PROBE))
+    except OSError:
+        return False
+
+
+def iter_tasks(files, chunk_size, binary_files="binary"):
+    """
+    yield (f, start, end, last) for the workers, `start` is None when `f` is searched as a whole,
+    `last` marks the last chunk of a file
+    """
+    for f in files:
+        try:
+            size = os.path.getsize(f) if os.path.isfile(f) else 0
+        except OSError:
+            size = 0
+        # a big binary file stays in one piece, its first match ends the search
+        if chunk_size is None or size <= chunk_size or (binary_files != "text" and probe_binary(f)):
+            yield f, None, None, True
+            continue
+        for start in range(0, size, chunk_size):
+            end = min(start + chunk_size, size)
+            yield f, start, end, end >= size
+
+
+_worker_matcher = None
+_worker_options = None
+
+
+def _init_worker(matcher, options):
+    global _worker_matcher, _worker_options
+    _worker_matcher = matcher
+    _worker_options = options
+
+
+def _grep_task_worker(task):
+    f, start, end, last = task
+    if start is None:
+        # the whole output of a file goes back to the parent at once, so it can be kept in order
+        out = io.BytesIO()
+        n = grep_file(f, _worker_matcher, _worker_options, out)
+        return task, out.getvalue(), n, None
+    try:
+        matches, n, lines = grep_chunk(f, _worker_matcher, _worker_options, start, end)
+    except Exception as e:
+        return task, b"%s\n" % str(e).encode(errors="replace"), 0, None
+    return task, matches, n, lines
+
+
+def search(files, matcher, options, out, jobs):
+    """ search `files`, or stdin when it's None, return True if anything matched """
+    if files is None:
+        # don't use input(), or we can't get input from pipe in win32 platform(works fine under Mac OS, though)
+        return grep_stdin(matcher, options, out) > 0
+
+    matched = False
+    if jobs <= 1:
+        for f in files:
+            if grep_file(f, matcher, options, out) > 0:
+                matched = True
+                if options.quiet:
+                    break
+        return matched
+
+    # a file that stops at the first few matches is read from the start by one worker
+    tasks = iter_tasks(files, CHUNK_SIZE if options.stop_at() is None else None, options.binary_files)
+    with multiprocessing.Pool(jobs, _init_worker, (matcher, options)) as pool:
+        if options.quiet:
+            # any hit will do, take them as they come and leave the rest of the pool behind
+            results = pool.imap_unordered(_grep_task_worker, tasks)
+        else:
+            # `imap` hands results back in the order of `tasks`, and yields each one as soon as
+            # it and every task before it are done, so output streams while later files are searched.
+            # it also pulls `tasks` from its own thread, so the directory walk keeps going meanwhile
+            results = pool.imap(_grep_task_worker, tasks)
+        # line number, match count and last line written of the file being put together from its chunks
+        base = 0
+        total = 0
+        last_no = -1
+        context = options.context() != (0, 0)
+        for (f, start, end, last), output, n, lines in results:
+            if n > 0:
+                matched = True
+                if options.quiet:
+                    break
+            if lines is None:
+                out.write(output)
+            else:
+                if start == 0:
+                    base = 0
+                    total = 0
+                    last_no = -1
+                name = os.fsencode(f)
+                for no, line, is_match in output:
+                    no += base
+                    if no <= last_no:
+                        continue
+                    if context and last_no >= 0 and no > last_no + 1:
+                        out.write(SEPARATOR)
+                    out.write(format_line(name, no, line, is_match))
+                    last_no = no
+                base += lines
+                total += n
+                if last and options.count:
+                    out.write(format_count(name, total))
+            # a batch per task, so the output keeps streaming
+            out.flush()
+    return matched
+
+
+def build_index(d, walker):
+    index = TrigramIndex(d)
+    if index.exists():
+        try:
+            index.load()
+        except IndexFormatError as e:
+            print("{}, building it anew".format(e), file=sys.stderr)
+            index = TrigramIndex(d)
+    indexed, updated, removed = index.update(walker.walk(d))
+    index.save()
+    print("{}: {} files indexed, {} read, {} removed".format(d, indexed, updated, removed))
+    return 0
+
+
+def main():
+    optlist, args = getopt.getopt(sys.argv[1:], "iFe:f:lcqm:A:B:C:aIj:rR",
+                                  ["ignore-case", "fixed-strings", "regexp=", "file=",
+                                   "files-with-matches", "count", "quiet", "silent", "max-count=",
+                                   "after-context=", "before-context=", "context=",
+                                   "text", "binary-files=",
+                                   "jobs=", "recursive", "dereference-recursive",
+                                   "include=", "exclude=", "exclude-dir=", "index="])
 
     flag = 0
+    fixed = False
+    patterns = None
+    options = GrepOptions()
+    jobs = 1
+    recursive = False
+    follow_links = False
+    include = []
+    exclude = []
+    exclude_dir = []
+    index_dir = None
     for o, a, in optlist:
-        if o == "-i":
+        if o in ("-i", "--ignore-case"):
             flag |= re.IGNORECASE
+        elif o in ("-F", "--fixed-strings"):
+            fixed = True
+        elif o in ("-e", "--regexp"):
+            patterns = (patterns or []) + [os.fsencode(a)]
+        elif o in ("-f", "--file"):
+            with open(a, "rb") as fp:
+                patterns = (patterns or []) + fp.read().splitlines()
+        elif o in ("-l", "--files-with-matches"):
+            options.list_files = True
+        elif o in ("-c", "--count"):
+            options.count = True
+        elif o in ("-q", "--quiet", "--silent"):
+            options.quiet = True
+        elif o in ("-m", "--max-count"):
+            options.max_count = int(a)
+        elif o in ("-A", "--after-context"):
+            options.after = int(a)
+        elif o in ("-B", "--before-context"):
+            options.before = int(a)
+        elif o in ("-C", "--context"):
+            options.before = options.after = int(a)
+        elif o in ("-a", "--text"):
+            options.binary_files = "text"
+        elif o == "-I":
+            options.binary_files = "without-match"
+        elif o == "--binary-files":
+            if a not in ("binary", "without-match", "text"):
+                print("invalid argument for --binary-files: {}".format(a))
+                usage()
+                return 2
+            options.binary_files = a
+        elif o in ("-j", "--jobs"):
+            jobs = int(a)
+            if jobs <= 0:
+                jobs = os.cpu_count() or 1
+        elif o in ("-r", "--recursive"):
+            recursive = True
+        elif o in ("-R", "--dereference-recursive"):
+            recursive = True
+            follow_links = True
+        elif o == "--include":
+            include.append(a)
+        elif o == "--exclude":
+            exclude.append(a)
+        elif o == "--exclude-dir":
+            exclude_dir.append(a)
+        elif o == "--index":
+            index_dir = a
 
-    pattern = args[0]
-    file_list = args[1:]
-    max_len = 4096
+    walker = None
+    if recursive or index_dir is not None:
+        walker = DirWalker(follow_links, include, exclude, exclude_dir, threads=max(4, jobs))
 
-    prog = re.compile(pattern, flag)
+    if patterns is None:
+        if len(args) <= 0:
+            if index_dir is not None:
+                return build_index(index_dir, walker)
+            usage()
+            return 1
+        patterns = [args[0]]
+        args = args[1:]
 
-    if len(file_list) <= 0:
-        # don't use input(), or we can't get input from pipe in win32 platform(works fine under Mac OS, though)
-        for line in iter(lambda: sys.stdin.readline(max_len), ''):
-            if prog.search(line):
-                print(line, end='')
-    else:
-        for f in file_list:
-            if not os.path.isfile(f):
-                print("{}: not a file".format(f))
-                continue
+    if options.max_count == 0:
+        # like GNU grep, -m 0 stops before any file is opened, with nothing matched
+        return 1
+
+    file_list = args
+    matcher = make_matcher(patterns, flag, fixed)
+
+    if walker is not None and len(file_list) <= 0:
+        file_list = [index_dir if index_dir is not None else "."]
+
+    files = iter_files(file_list, walker) if len(file_list) > 0 else None
+    index_filter = None
+    # -c has to print a count for the files the index rules out as well
+    if index_dir is not None and not options.count:
+        index = TrigramIndex(index_dir)
+        if not index.exists():
+            print("{}: no index, build it with `grep --index={}`".format(index_dir, index_dir), file=sys.stderr)
+        else:
             try:
-                with open(f, "rb") as fp:
-                    # _io.BufferedReader
-                    for no, line in enumerate(iter(lambda: fp.readline(max_len), b'')):
-                        # TODO: separate binary file and text file
-                        line = line.decode()
-                        if prog.search(line):
-                            # win32 needs this `end=''`, but linux/mac doesn't
-                            print("{}:{}: {}".format(f, no, line), end='')
-            except Exception as e:
-                print(e)
+                index.load()
+            except IndexFormatError as e:
+                # searched without it
+                print("{}, rebuild it with `grep --index={}`".format(e, index_dir), file=sys.stderr)
+            else:
+                index_filter = IndexFilter(index, index_query(patterns, fixed))
+                files = index_filter.filter(files)
+
+    out = Output()
+    try:
+        matched = search(files, matcher, options, out, jobs)
+    finally:
+        out.flush()
+    if index_filter is not None:
+        print("index: {} of {} files pruned".format(index_filter.pruned, index_filter.total), file=sys.stderr)
+    return 0 if matched else 1
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Read trees and blobs of a local git repository through the git command, without a checkout.
+"""
+
+import subprocess
+
+
+# regular and executable files, symlinks (120000) and submodules (160000) have no content of their own
+_FILE_MODES = (b"100644", b"100755")
+
+
+class GitError(Exception):
+    pass
+
+
+class GitRepo():
+    """ `path` is a directory in the work tree, paths are given and returned relative to it """
+    def __init__(self, path):
+        self.path = path
+        # a long running `git cat-file --batch`, one per repository
+        self.cat = None
+
+    def git(self, *args):
+        return ["git", "-C", self.path] + list(args)
+
+    def ls_tree(self, rev, paths=()):
+        """ yield (blob id, path) of every file of `rev` under `paths` (all of them if empty) """
+        proc = subprocess.Popen(self.git("ls-tree", "-r", "-z", rev, "--", *paths),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            rest = b''
+            for buf in iter(lambda: proc.stdout.read(1 << 16), b''):
+                entries = (rest + buf).split(b'\0')
+                rest = entries.pop()
+                for entry in entries:
+                    # <mode> SP <type> SP <object> TAB <path>
+                    meta, path = entry.split(b'\t', 1)
+                    mode, kind, sha = meta.split(b' ')
+                    if kind == b"blob" and mode in _FILE_MODES:
+                        yield sha.decode(), path.decode(errors="surrogateescape")
+        finally:
+            proc.stdout.close()
+            err = proc.stderr.read()
+            proc.stderr.close()
+            if proc.wait() != 0:
+                raise GitError("{}: {}".format(rev, err.decode(errors="replace").strip()))
+
+    def blob_blocks(self, sha, block_size=1 << 20, first_size=None):
+        """
+        yield the content of blob `sha` as memoryviews of one reusable buffer, each only valid
+        until the next one is asked for. the first one is `first_size` bytes whatever `block_size`
+        is (or all of a shorter blob)
+        """
+        if self.cat is None:
+            self.cat = subprocess.Popen(self.git("cat-file", "--batch"),
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.cat.stdin.write(sha.encode() + b"\n")
+        self.cat.stdin.flush()
+        out = self.cat.stdout
+        # <object> SP <type> SP <size> LF <content> LF, or <object> SP missing LF
+        header = out.readline().split()
+        if len(header) != 3 or header[1] != b"blob":
+            raise GitError("{}: not a blob".format(sha))
+        left = int(header[2])
+        buf = bytearray(min(max(block_size, first_size or 0), left) or 1)
+        view = memoryview(buf)
+        size = first_size or block_size
+        try:
+            while left > 0:
+                n = out.readinto(view[:min(left, size)])
+                size = block_size
+                if not n:
+                    raise GitError("{}: truncated".format(sha))
+                left -= n
+                yield view[:n]
+        finally:
+            # the rest of the blob has to go, even if the caller gave up, or the next reply is off
+            while left > 0:
+                n = len(out.read(min(left, 1 << 20)))
+                if not n:
+                    break
+                left -= n
+            out.read(1)
+
+    def close(self):
+        if self.cat is not None:
+            self.cat.stdin.close()
+            self.cat.wait()
+            self.cat.stdout.close()
+            self.cat = None
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Line diffs of large inputs: Myers, patience and histogram, on arrays of line ids.
+
+Lines are interned to small integers first, so every comparison is one of machine integers and
+both inputs together take a few bytes per line besides the distinct lines themselves. Every
+region is trimmed of its common prefix and suffix (slice compares, not a loop per line) before
+an algorithm splits what's left, and regions are worked off an explicit stack, so neither the
+input size nor the number of changes runs into the recursion limit.
+
+The result is given the way difflib.SequenceMatcher gives it (matching blocks, opcodes, grouped
+opcodes), so the same output formats can be made from it.
+"""
+
+import collections
+import itertools
+
+from array import array
+from bisect import bisect_left
+
+
+ALGORITHMS = ("myers", "patience", "histogram")
+
+# histogram diff skips lines occurring more often than this in a region, like git does
+_MAX_CHAIN = 64
+
+# the most items compared as one slice while trimming, the copies stay small
+_MAX_STEP = 1 << 16
+
+# diagonals Myers starts with each way, twice as many each time they run out
+_FIRST_DIAGONALS = 1 << 10
+
+# the lowest cost limit of Myers, every step of it is Python
+_MIN_COST = 256
+
+
+def intern_lines(a, b):
+    """ `a` and `b` as arrays of line ids, equal lines getting equal ids """
+    ids = {}
+    intern = ids.setdefault
+    a = array('I', [intern(line, len(ids)) for line in a])
+    b = array('I', [intern(line, len(ids)) for line in b])
+    return a, b
+
+
+def common_prefix(a, alo, ahi, b, blo, bhi):
+    """ the number of equal items at the start of a[alo:ahi] and b[blo:bhi] """
+    n = min(ahi - alo, bhi - blo)
+    k = 0
+    step = 1
+    # gallop while whole slices are equal, then halve down to the first difference
+    while k + step <= n and a[alo + k:alo + k + step] == b[blo + k:blo + k + step]:
+        k += step
+        step = min(step * 2, _MAX_STEP)
+    while step > 1:
+        step //= 2
+        if k + step <= n and a[alo + k:alo + k + step] == b[blo + k:blo + k + step]:
+            k += step
+    return k
+
+
+def common_suffix(a, alo, ahi, b, blo, bhi):
+    """ the number of equal items at the end of a[alo:ahi] and b[blo:bhi] """
+    n = min(ahi - alo, bhi - blo)
+    k = 0
+    step = 1
+    while k + step <= n and a[ahi - k - step:ahi - k] == b[bhi - k - step:bhi - k]:
+        k += step
+        step = min(step * 2, _MAX_STEP)
+    while step > 1:
+        step //= 2
+        if k + step <= n and a[ahi - k - step:ahi - k] == b[bhi - k - step:bhi - k]:
+            k += step
+    return k
+
+
+def _cost_limit(n, m):
+    """ the edit distance Myers looks for before it settles for a split that may not be the best """
+    # about the square root of the number of diagonals, like GNU diff's `too_expensive`
+    limit = 1
+    diagonals = n + m + 3
+    while diagonals:
+        limit <<= 1
+        diagonals >>= 2
+    return max(_MIN_COST, limit)
+
+
+def _middle(a, alo, ahi, b, blo, bhi):
+    """
+    where a shortest edit script of a[alo:ahi] to b[blo:bhi] crosses its middle, as offsets
+    (x, y, True) into both, None if they have nothing in common. both are trimmed already.
+
+    past the cost limit the search gives up on the shortest script, and gives (x, y, False)
+    of the point the furthest from its end that a path got to, from either end
+    """
+    n = ahi - alo
+    m = bhi - blo
+    max_d = (n + m + 1) // 2
+    cost_limit = _cost_limit(n, m)
+    # the furthest x reached on every diagonal k = x - y, from the start and from the end, at
+    # v[offset + k]. they grow with d, a few changes in many lines don't take a slot per line
+    offset = min(max_d, _FIRST_DIAGONALS)
+    size = 2 * offset + 2
+    v1 = [-1] * size
+    v2 = [-1] * size
+    v1[offset + 1] = 0
+    v2[offset + 1] = 0
+    delta = n - m
+    # with an odd delta the forward paths meet the reverse ones, else the other way round
+    front = delta % 2 != 0
+    # diagonals that ran off the edges aren't looked at again
+    k1start = k1end = k2start = k2end = 0
+    for d in range(max_d):
+        if d >= cost_limit:
+            split = _furthest(v1, v2, offset, d - 1, n, m, (k1start, k1end, k2start, k2end))
+            if split is not None:
+                return split + (False,)
+        if d >= offset:
+            grow = min(max_d, 2 * offset) - offset
+            v1 = [-1] * grow + v1 + [-1] * grow
+            v2 = [-1] * grow + v2 + [-1] * grow
+            offset += grow
+            size = 2 * offset + 2
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = offset + k1
+            if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            if x1 < n and y1 < m and a[alo + x1] == b[blo + y1]:
+                # snakes between changes are long, follow them by slices
+                snake = common_prefix(a, alo + x1, ahi, b, blo + y1, bhi)
+                x1 += snake
+                y1 += snake
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = offset + delta - k1
+                if 0 <= k2_offset < size and v2[k2_offset] != -1 and x1 >= n - v2[k2_offset]:
+                    return x1, y1, True
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = offset + k2
+            if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            if x2 < n and y2 < m and a[ahi - x2 - 1] == b[bhi - y2 - 1]:
+                snake = common_suffix(a, alo, ahi - x2, b, blo, bhi - y2)
+                x2 += snake
+                y2 += snake
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = offset + delta - k2
+                if 0 <= k1_offset < size and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    if x1 >= n - x2:
+                        return x1, offset + x1 - k1_offset, True
+    return None
+
+
+def _furthest(v1, v2, offset, d, n, m, bounds):
+    """
+    the point (x, y) strictly inside the region that the paths of `d` changes got furthest
+    to, from the start (v1) or from the end (v2), None if none did
+    """
+    k1start, k1end, k2start, k2end = bounds
+    best = None
+    progress = 0
+    for k in range(-d + k1start, d + 1 - k1end, 2):
+        x = v1[offset + k]
+        y = x - k
+        if 0 <= x <= n and 0 <= y <= m and progress < x + y < n + m:
+            best = (x, y)
+            progress = x + y
+    for k in range(-d + k2start, d + 1 - k2end, 2):
+        x = v2[offset + k]
+        y = x - k
+        if 0 <= x <= n and 0 <= y <= m and progress < x + y < n + m:
+            best = (n - x, m - y)
+            progress = x + y
+    return best
+
+
+def _split_myers(a, alo, ahi, b, blo, bhi):
+    split = _middle(a, alo, ahi, b, blo, bhi)
+    if split is None:
+        return []
+    x, y, exact = split
+    if not exact:
+        # as much as the sets cost has been spent already, see if they make it cheaper
+        blocks = _without_unmatched(a, alo, ahi, b, blo, bhi)
+        if blocks is not None:
+            return blocks
+    return [(alo, alo + x, blo, blo + y), (alo + x, ahi, blo + y, bhi)]
+
+
+def _matched_only(x, lo, hi, other):
+    """ (the items of x[lo:hi] that are in the set `other`, where they were in x) """
+    items = x[lo:hi]
+    mask = bytes(map(other.__contains__, items))
+    kept = array('Q', itertools.compress(range(lo, hi), mask))
+    if isinstance(items, array):
+        return array(items.typecode, itertools.compress(items, mask)), kept
+    return list(itertools.compress(items, mask)), kept
+
+
+def _without_unmatched(a, alo, ahi, b, blo, bhi):
+    """
+    the matching blocks of a region too expensive for Myers, found without the lines of one
+    side the other doesn't have at all, like GNU diff drops them: they can't match, but Myers
+    pays for every one of them. none at all when the sides have nothing in common, None when
+    every line has a match somewhere
+    """
+    a_set = set(a[alo:ahi])
+    b_set = set(b[blo:bhi])
+    if a_set.isdisjoint(b_set):
+        # all of a is replaced by all of b
+        return []
+    a_kept, a_at = _matched_only(a, alo, ahi, b_set)
+    b_kept, b_at = _matched_only(b, blo, bhi, a_set)
+    del a_set, b_set
+    if len(a_kept) == ahi - alo and len(b_kept) == bhi - blo:
+        return None
+    blocks = []
+    for p, q, n in _match(a_kept, 0, len(a_kept), b_kept, 0, len(b_kept), "myers"):
+        # a run of the kept lines is one of the original lines only where none was dropped,
+        # it's cut in halves until the pieces are
+        pieces = [(p, q, n)]
+        while pieces:
+            p, q, n = pieces.pop()
+            if a_at[p + n - 1] - a_at[p] == n - 1 and b_at[q + n - 1] - b_at[q] == n - 1:
+                _add_block(blocks, a_at[p], b_at[q], n)
+            else:
+                half = n // 2
+                pieces.append((p + half, q + half, n - half))
+                pieces.append((p, q, half))
+    return blocks
+
+
+def _unique_pairs(a, alo, ahi, b, blo, bhi):
+    """ [(i, j)] of the lines occurring exactly once in both regions, in the order of a """
+    # line -> its index, -1 once it's seen twice
+    in_a = {}
+    for i in range(alo, ahi):
+        in_a[a[i]] = -1 if a[i] in in_a else i
+    in_b = {}
+    for j in range(blo, bhi):
+        line = b[j]
+        if in_a.get(line, -1) >= 0:
+            in_b[line] = -1 if line in in_b else j
+    return sorted((in_a[line], j) for line, j in in_b.items() if j >= 0)
+
+
+def _longest_increasing(pairs):
+    """ the longest run of `pairs` (sorted by i) whose j increase too, by patience sorting """
+    # the j of the top card of every pile, and the index of that card in pairs
+    tops = []
+    top_index = []
+    previous = [-1] * len(pairs)
+    for index, (i, j) in enumerate(pairs):
+        pile = bisect_left(tops, j)
+        if pile > 0:
+            previous[index] = top_index[pile - 1]
+        if pile == len(tops):
+            tops.append(j)
+            top_index.append(index)
+        else:
+            tops[pile] = j
+            top_index[pile] = index
+    result = []
+    index = top_index[-1] if top_index else -1
+    while index >= 0:
+        result.append(pairs[index])
+        index = previous[index]
+    result.reverse()
+    return result
+
+
+def _split_patience(a, alo, ahi, b, blo, bhi):
+    anchors = _longest_increasing(_unique_pairs(a, alo, ahi, b, blo, bhi))
+    if not anchors:
+        return _split_myers(a, alo, ahi, b, blo, bhi)
+    parts = []
+    i0, j0 = alo, blo
+    for i, j in anchors:
+        parts.append((i0, i, j0, j))
+        parts.append((i, j, 1))
+        i0, j0 = i + 1, j + 1
+    parts.append((i0, ahi, j0, bhi))
+    return parts
+
+
+def _repeated(a, alo, ahi, counts):
+    """ line -> [its indexes] in a[alo:ahi], for the lines occurring 2 to _MAX_CHAIN times """
+    repeated = {line for line, count in counts.items() if 1 < count <= _MAX_CHAIN}
+    where = {}
+    for i in itertools.compress(range(alo, ahi), map(repeated.__contains__, a[alo:ahi])):
+        where.setdefault(a[i], []).append(i)
+    return where
+
+
+def _histogram_runs(a, alo, ahi, b, blo, bhi, counts, last, repeated):
+    """
+    the runs (i, j, size) of equal lines around the lines of a[alo:ahi] occurring the fewest
+    times, each with its line, and that count. the lines occurring more than once are left out
+    while `repeated` is None, and the third value tells whether one was
+    """
+    runs = {}
+    best_count = _MAX_CHAIN
+    skipped = False
+    j = blo
+    while j < bhi:
+        line = b[j]
+        count = counts.get(line, 0)
+        j_next = j + 1
+        if count == 1:
+            found = (last[line],)
+        elif repeated is None:
+            skipped = skipped or count > 0
+            found = ()
+        else:
+            found = repeated.get(line, ())
+        if found and count <= best_count:
+            if count < best_count:
+                runs.clear()
+                best_count = count
+            for i in found:
+                # the whole run of equal lines around (i, j)
+                start = common_suffix(a, alo, i, b, blo, j)
+                end = common_prefix(a, i, ahi, b, j, bhi)
+                runs.setdefault((i - start, j - start, start + end), line)
+                j_next = max(j_next, j + end)
+        j = j_next
+    return runs, best_count, skipped
+
+
+def _split_histogram(a, alo, ahi, b, blo, bhi):
+    """
+    anchors at the longest run of equal lines around a line occurring the fewest times in a,
+    like git. when those lines occur once on both sides, every run of them that keeps its
+    order in both is an anchor of the same pass, not only the first of many alike
+    """
+    lines = a[alo:ahi]
+    counts = collections.Counter(lines)
+    # the last index of a line, its only one when it occurs once
+    last = dict(zip(lines, range(alo, ahi)))
+    # the indexes of the lines occurring more than once are only taken when none occurring
+    # once is in b too, that's rare in a region of many lines
+    runs, best_count, skipped = _histogram_runs(a, alo, ahi, b, blo, bhi, counts, last, None)
+    if not runs and skipped:
+        repeated = _repeated(a, alo, ahi, counts)
+        runs, best_count, _ = _histogram_runs(a, alo, ahi, b, blo, bhi, counts, last, repeated)
+    if not runs:
+        return _split_myers(a, alo, ahi, b, blo, bhi)
+    if best_count == 1:
+        in_b = collections.Counter(b[blo:bhi])
+        unique = {(i, j): size for (i, j, size), line in runs.items() if in_b[line] == 1}
+    else:
+        unique = None
+    if not unique:
+        # the longest one, the first of them on a tie
+        i, j, size = max(runs, key=lambda run: (run[2], -run[1]))
+        return [(alo, i, blo, j), (i, j, size), (i + size, ahi, j + size, bhi)]
+    parts = []
+    i0, j0 = alo, blo
+    for i, j in _longest_increasing(sorted(unique)):
+        if i >= i0 and j >= j0:
+            # runs of different lines may overlap, the later one is dropped
+            size = unique[i, j]
+            parts.append((i0, i, j0, j))
+            parts.append((i, j, size))
+            i0, j0 = i + size, j + size
+    parts.append((i0, ahi, j0, bhi))
+    return parts
+
+
+_SPLITS = {
+    "myers": _split_myers,
+    "patience": _split_patience,
+    "histogram": _split_histogram,
+}
+
+
+def _add_block(blocks, i, j, n):
+    """ append block (i, j, n) to `blocks`, merged with the last one when it goes on from it """
+    if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+        blocks[-1] = (blocks[-1][0], blocks[-1][1], blocks[-1][2] + n)
+    else:
+        blocks.append((i, j, n))
+
+
+def matching_blocks(a, b, algorithm="myers"):
+    """
+    [(i, j, n)] of a[i:i+n] == b[j:j+n] in increasing order, adjacent ones merged, ending
+    with (len(a), len(b), 0), like SequenceMatcher.get_matching_blocks()
+    """
+    blocks = _match(a, 0, len(a), b, 0, len(b), algorithm)
+    blocks.append((len(a), len(b), 0))
+    return blocks
+
+
+def _match(a, alo, ahi, b, blo, bhi, algorithm):
+    """ the matching blocks of a[alo:ahi] and b[blo:bhi] by `algorithm`, without the end one """
+    split = _SPLITS[algorithm]
+    blocks = []
+    # regions (alo, ahi, blo, bhi) still to diff and blocks (i, j, n) found, the next on top
+    todo = [(alo, ahi, blo, bhi)]
+    while todo:
+        item = todo.pop()
+        if len(item) == 3:
+            _add_block(blocks, *item)
+            continue
+        alo, ahi, blo, bhi = item
+        if alo == ahi or blo == bhi:
+            continue
+        prefix = common_prefix(a, alo, ahi, b, blo, bhi)
+        suffix = common_suffix(a, alo + prefix, ahi, b, blo + prefix, bhi)
+        parts = []
+        if prefix:
+            parts.append((alo, blo, prefix))
+        if alo + prefix < ahi - suffix and blo + prefix < bhi - suffix:
+            parts.extend(split(a, alo + prefix, ahi - suffix, b, blo + prefix, bhi - suffix))
+        if suffix:
+            parts.append((ahi - suffix, bhi - suffix, suffix))
+        todo.extend(reversed(parts))
+    return blocks
+
+
+def edit_counts(a, b, algorithm="myers"):
+    """
+    (inserted, deleted, changed) lines of the diff of `a` and `b`, from the matching blocks
+    alone. a line replaced by another is both inserted and deleted, and counts as changed
+    """
+    inserted = deleted = changed = 0
+    i = j = 0
+    for ai, bj, size in matching_blocks(a, b, algorithm):
+        inserted += bj - j
+        deleted += ai - i
+        changed += min(ai - i, bj - j)
+        i, j = ai + size, bj + size
+    return inserted, deleted, changed
+
+
+class LineMatcher():
+    """ the diff of line id arrays `a` and `b`, asked like a difflib.SequenceMatcher """
+    def __init__(self, a, b, algorithm="myers"):
+        self.a = a
+        self.b = b
+        self.algorithm = algorithm
+        self.blocks = None
+
+    def get_matching_blocks(self):
+        if self.blocks is None:
+            self.blocks = matching_blocks(self.a, self.b, self.algorithm)
+        return self.blocks
+
+    def get_opcodes(self):
+        """ [(tag, i1, i2, j1, j2)] turning a into b, tags as SequenceMatcher has them """
+        i = j = 0
+        opcodes = []
+        for ai, bj, size in self.get_matching_blocks():
+            if i < ai and j < bj:
+                opcodes.append(("replace", i, ai, j, bj))
+            elif i < ai:
+                opcodes.append(("delete", i, ai, j, bj))
+            elif j < bj:
+                opcodes.append(("insert", i, ai, j, bj))
+            i, j = ai + size, bj + size
+            if size:
+                opcodes.append(("equal", ai, i, bj, j))
+        return opcodes
+
+    def get_grouped_opcodes(self, n=3):
+        """ yield the hunks of opcodes with up to `n` lines of context, like SequenceMatcher """
+        codes = self.get_opcodes()
+        if not codes:
+            codes = [("equal", 0, 1, 0, 1)]
+        if codes[0][0] == "equal":
+            tag, i1, i2, j1, j2 = codes[0]
+            codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+        if codes[-1][0] == "equal":
+            tag, i1, i2, j1, j2 = codes[-1]
+            codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+        group = []
+        for tag, i1, i2, j1, j2 in codes:
+            if tag == "equal" and i2 - i1 > n + n:
+                group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+                yield group
+                group = []
+                i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+            group.append((tag, i1, i2, j1, j2))
+        if group and not (len(group) == 1 and group[0][0] == "equal"):
+            yield group
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+The lines of a file kept as a memory map, an array of where every line starts and an array of
+a 64-bit hash of every line, so a diff of files of many GB takes 16 bytes per line of memory
+and never has the text of a line as a Python object until it's printed.
+
+The map is indexed a chunk at a time: a chunk is split at its newlines and the lengths and
+hashes of its lines are taken with map() over the pieces, not a Python loop per line. Lines are
+told apart by their hash alone, and a collision of two 64-bit hashes passes for equal lines.
+
+The 16 bytes a line are all it takes with the Myers engine, the one diff.py picks for --mmap,
+which only adds its diagonals. Patience and histogram count the lines in dicts, a few hundred
+bytes a line more while they run.
+"""
+
+import itertools
+import locale
+import mmap
+import os
+
+from array import array
+
+
+# bytes split into lines at a time while indexing
+INDEX_CHUNK = 1 << 22
+
+
+class MappedLines():
+    """ the lines of file `path`, a line being everything up to and with a b'\\n' """
+    def __init__(self, path, encoding=None):
+        self.path = path
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        # where line i starts is starts[i], where it ends starts[i + 1]
+        self.starts = array('Q', [0])
+        self.hashes = array('q')
+        self.fp = open(path, 'rb')
+        size = os.fstat(self.fp.fileno()).st_size
+        # an empty file can't be mapped
+        self.map = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.index()
+
+    def index(self):
+        data = self.map
+        size = len(data)
+        pos = 0
+        while pos < size:
+            end = data.rfind(b'\n', pos, pos + INDEX_CHUNK)
+            if end < 0:
+                # a line longer than a chunk
+                end = data.find(b'\n', pos + INDEX_CHUNK)
+            end = size if end < 0 else end + 1
+            pieces = data[pos:end].split(b'\n')
+            last = pieces.pop()
+            self.hashes.extend(map(hash, pieces))
+            # where every line of the chunk ends, the next one starts
+            ends = itertools.accumulate(map((1).__add__, map(len, pieces)), initial=pos)
+            self.starts.extend(itertools.islice(ends, 1, None))
+            if last:
+                # the last line, without a newline, must not hash like the same line with one
+                self.hashes.append(hash((last,)))
+                self.starts.append(size)
+            pos = end
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def line(self, i):
+        return self.map[self.starts[i]:self.starts[i + 1]].decode(self.encoding, errors="replace")
+
+    def __getitem__(self, index):
+        """ line `index`, or the lines of a slice as an iterator, decoded as they're taken """
+        if isinstance(index, slice):
+            return map(self.line, range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.line(index)
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.fp.close()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A persistent cache of per-file codestat results, so a rerun over the same tree only counts the
+files that changed since.
+
+Entries are keyed by absolute path, and are only used while the file's size, mtime and inode
+are still the ones it was counted with. Every run that opens the cache for writing gets a new
+run number, entries remember the last run that used them, and the ones unused the longest are
+dropped when there are more than `max_entries`.
+"""
+
+import json
+import os
+import os.path
+import pathlib
+import sqlite3
+
+
+# bump whenever the counting changes, so results of the old rules aren't served
+CACHE_VERSION = 4
+
+DEFAULT_MAX_ENTRIES = 1 << 20
+
+# pending writes per transaction
+_FLUSH_EVERY = 4096
+
+
+def default_path():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "codestat", "stat.db")
+
+
+class StatCache():
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES, readonly=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.readonly = readonly
+        self.db = None
+        self.run = 0
+        # (path, size, mtime_ns, inode, data) of new results
+        self.puts = []
+        # paths served from the cache in this run
+        self.touches = []
+
+    def open(self):
+        if self.readonly:
+            # workers only read, the process that opened it for writing keeps it up to date.
+            # as_uri() escapes '#', '?' and '%' of the path and puts a drive of Windows right
+            uri = pathlib.Path(os.path.abspath(self.path)).as_uri() + "?mode=ro"
+            self.db = sqlite3.connect(uri, uri=True, timeout=60)
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=60)
+        # readers in other processes aren't blocked by the writer
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != CACHE_VERSION:
+            self.db.execute("DROP TABLE IF EXISTS files")
+            self.db.execute("DROP TABLE IF EXISTS meta")
+            self.db.execute("PRAGMA user_version={}".format(CACHE_VERSION))
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files ("
+                        "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, inode INTEGER, "
+                        "used INTEGER, data TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_used ON files (used)")
+        row = self.db.execute("SELECT value FROM meta WHERE key='run'").fetchone()
+        self.run = (row[0] if row else 0) + 1
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('run', ?)", (self.run,))
+        self.db.commit()
+
+    def key(self, f):
+        """ what a result of `f` is valid for, raise OSError like open() would """
+        st = os.stat(f)
+        return os.path.abspath(f), st.st_size, st.st_mtime_ns, st.st_ino
+
+    def get(self, key):
+        """ the cached result (a dict) for `key`, None if there's none or the file has changed """
+        row = self.db.execute("SELECT data FROM files WHERE path=? AND size=? AND mtime=? AND inode=?",
+                              key).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, data):
+        self.puts.append(key + (json.dumps(data),))
+        if len(self.puts) >= _FLUSH_EVERY:
+            self.flush()
+
+    def touch(self, key):
+        self.touches.append(key[0])
+        if len(self.touches) >= _FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, {}, ?)".format(self.run),
+                                self.puts)
+            self.db.executemany("UPDATE files SET used={} WHERE path=?".format(self.run),
+                                ((path,) for path in self.touches))
+        self.puts = []
+        self.touches = []
+
+    def evict(self):
+        """ drop the entries unused the longest, down to `max_entries` """
+        count = self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        if count <= self.max_entries:
+            return 0
+        with self.db:
+            self.db.execute("DELETE FROM files WHERE path IN "
+                            "(SELECT path FROM files ORDER BY used LIMIT ?)", (count - self.max_entries,))
+        return count - self.max_entries
+
+    def close(self):
+        if self.db is None:
+            return
+        if not self.readonly:
+            self.flush()
+            self.evict()
+        self.db.close()
+        self.db = None
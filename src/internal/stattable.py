@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Per-file codestat results kept as columns, so millions of them take a few dozen bytes each.
+
+Every column is an array of machine integers: the directory and type of a file are ids into
+small interned lists, and the file names are packed into one byte buffer. Reductions run over
+whole columns with C-level iteration (sum, map, itertools.compress, heapq), not a Python loop
+per file.
+"""
+
+import heapq
+import itertools
+import operator
+import os.path
+
+from array import array
+
+
+class StatTable():
+    def __init__(self):
+        # interned directories and types, id -> value
+        self.dirs = []
+        self.dir_ids = {}
+        self.types = []
+        self.type_ids = {}
+        # type -> language name
+        self.languages = {}
+        # file names (without directory) one after another, and where each one ends
+        self.names = bytearray()
+        self.name_ends = array('Q')
+        self.dir = array('I')
+        self.type = array('H')
+        self.code = array('Q')
+        self.comment = array('Q')
+        self.blank = array('Q')
+        # the directory and first row of every run of rows in the same directory
+        self.run_dirs = array('I')
+        self.run_starts = array('Q')
+
+    def __len__(self):
+        return len(self.code)
+
+    def intern(self, values, ids, value):
+        i = ids.get(value)
+        if i is None:
+            i = ids[value] = len(values)
+            values.append(value)
+        return i
+
+    def add(self, path, file_type, language, code, comment, blank):
+        directory, name = os.path.split(path)
+        dir_id = self.intern(self.dirs, self.dir_ids, directory)
+        if not self.run_dirs or self.run_dirs[-1] != dir_id:
+            self.run_dirs.append(dir_id)
+            self.run_starts.append(len(self))
+        self.dir.append(dir_id)
+        self.type.append(self.intern(self.types, self.type_ids, file_type))
+        self.languages[file_type] = language
+        self.names += name.encode(errors="surrogateescape")
+        self.name_ends.append(len(self.names))
+        self.code.append(code)
+        self.comment.append(comment)
+        self.blank.append(blank)
+
+    def path(self, row):
+        start = self.name_ends[row - 1] if row > 0 else 0
+        name = self.names[start:self.name_ends[row]].decode(errors="surrogateescape")
+        return os.path.join(self.dirs[self.dir[row]], name)
+
+    def row(self, row):
+        """ (path, type, language, code, comment, blank) of a row """
+        file_type = self.types[self.type[row]]
+        return (self.path(row), file_type, self.languages[file_type],
+                self.code[row], self.comment[row], self.blank[row])
+
+    def lines(self):
+        """ the total lines of every row """
+        return map(operator.add, map(operator.add, self.code, self.comment), self.blank)
+
+    def top(self, n):
+        """ the rows of the `n` files with the most lines, the largest first """
+        return [self.row(row) for lines, row in heapq.nlargest(n, zip(self.lines(), itertools.count()))]
+
+    def sums(self, mask):
+        """ (code, comment, blank) of the rows `mask` (an iterable of truth values) selects """
+        mask = bytes(map(bool, mask))
+        return tuple(sum(itertools.compress(column, mask)) for column in (self.code, self.comment, self.blank))
+
+    def type_totals(self):
+        """ type -> (code, comment, blank) """
+        return {file_type: self.sums(map(type_id.__eq__, self.type)) for type_id, file_type in enumerate(self.types)}
+
+    def language_totals(self):
+        """ language -> (code, comment, blank), the largest first by code lines """
+        totals = {}
+        for file_type, counts in self.type_totals().items():
+            language = self.languages[file_type]
+            totals[language] = tuple(map(operator.add, totals.get(language, (0, 0, 0)), counts))
+        return sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
+
+    def dir_totals(self, root, depth):
+        """
+        [(directory, code, comment, blank)] of the directories `depth` levels under `root`, each
+        with everything below it. files less deep are rolled up into their own directory
+        """
+        keys = [self.rollup(directory, root, depth) for directory in self.dirs]
+        totals = {}
+        # a run per directory when the rows come in walk order, one per row at worst
+        ends = itertools.chain(itertools.islice(self.run_starts, 1, None), (len(self),))
+        for dir_id, start, end in zip(self.run_dirs, self.run_starts, ends):
+            key = keys[dir_id]
+            counts = (sum(self.code[start:end]), sum(self.comment[start:end]), sum(self.blank[start:end]))
+            totals[key] = tuple(map(operator.add, totals.get(key, (0, 0, 0)), counts))
+        return sorted((key,) + counts for key, counts in totals.items())
+
+    @staticmethod
+    def rollup(directory, root, depth):
+        """ `directory` cut down to `depth` levels under `root` """
+        root = root.rstrip("/\\") or root
+        if not directory.startswith(root) or directory[len(root):len(root) + 1] not in ("", "/", "\\"):
+            return directory
+        parts = [p for p in directory[len(root):].replace("\\", "/").split("/") if p]
+        return os.path.join(root, *parts[:depth]) if parts[:depth] else root
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+An on-disk trigram index of a directory tree, so repeated searches only read the files that
+can match.
+
+Every file is mapped to the set of 3-byte substrings of its (lower cased) content, kept as
+posting lists: trigram -> ids of the files containing it. A search turns its pattern into the
+trigrams every match must contain, and only the files holding all of them are candidates.
+
+The index file is a line of JSON (the version, the files and the sizes of what follows), then
+the trigrams, 3 bytes each, the length of every posting list and all the posting lists, as the
+raw bytes of arrays. Reading it runs no code from the file, unlike a pickle would.
+"""
+
+import json
+import os
+import os.path
+import re
+import sys
+
+from array import array
+
+
+INDEX_FILE_NAME = ".grepindex"
+
+INDEX_VERSION = 2
+
+# every position, overlapping
+_TRIGRAM = re.compile(b'(?=(...))', re.DOTALL)
+
+
+def trigrams(data):
+    """ the set of 3-byte substrings of `data`, lower cased """
+    return set(_TRIGRAM.findall(data.lower()))
+
+
+def file_trigrams(f, block=1 << 20, binary_probe=1 << 15):
+    """ return the trigrams of file `f`, None for a binary one (NUL in the first block) """
+    result = set()
+    with open(f, "rb") as fp:
+        tail = b''
+        first = True
+        for buf in iter(lambda: fp.read(block), b''):
+            if first and buf.find(b'\0', 0, binary_probe) >= 0:
+                return None
+            first = False
+            # keep the last 2 bytes, so trigrams across blocks aren't lost
+            buf = tail + buf
+            result.update(_TRIGRAM.findall(buf.lower()))
+            tail = buf[-2:]
+    return result
+
+
+class IndexFormatError(Exception):
+    pass
+
+
+class TrigramIndex():
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, INDEX_FILE_NAME)
+        # path relative to root -> (id, size, mtime_ns, binary)
+        self.files = {}
+        # trigram -> array of file ids
+        self.postings = {}
+        self.next_id = 0
+        # ids in the postings whose files have changed or gone
+        self.dead = 0
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self):
+        """ read the index file, raise IndexFormatError if it isn't one this version can read """
+        with open(self.path, "rb") as fp:
+            try:
+                header = json.loads(fp.readline())
+                version = header.get("version")
+            except (ValueError, AttributeError):
+                raise IndexFormatError("{}: not an index".format(self.path))
+            if version != INDEX_VERSION:
+                raise IndexFormatError("{}: unknown index version".format(self.path))
+            try:
+                count = header["trigrams"]
+                grams = fp.read(3 * count)
+                lengths = array('I')
+                lengths.fromfile(fp, count)
+                ids = array('I')
+                ids.fromfile(fp, header["ids"])
+                if len(grams) != 3 * count or sum(lengths) != len(ids):
+                    raise ValueError("sizes don't add up")
+                if header["byteorder"] != sys.byteorder:
+                    lengths.byteswap()
+                    ids.byteswap()
+                files = {rel: tuple(entry) for rel, entry in header["files"].items()}
+                next_id = header["next_id"]
+                dead = header["dead"]
+            except (KeyError, TypeError, ValueError, AttributeError, EOFError):
+                raise IndexFormatError("{}: broken index".format(self.path))
+        self.files = files
+        self.postings = {}
+        pos = 0
+        for k, length in enumerate(lengths):
+            self.postings[grams[3 * k:3 * k + 3]] = ids[pos:pos + length]
+            pos += length
+        self.next_id = next_id
+        self.dead = dead
+
+    def save(self):
+        grams = list(self.postings)
+        lengths = array('I', (len(self.postings[g]) for g in grams))
+        header = {
+            "version": INDEX_VERSION,
+            "files": self.files,
+            "next_id": self.next_id,
+            "dead": self.dead,
+            "trigrams": len(grams),
+            "ids": sum(lengths),
+            "byteorder": sys.byteorder,
+        }
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as fp:
+            fp.write(json.dumps(header).encode() + b"\n")
+            fp.write(b"".join(grams))
+            lengths.tofile(fp)
+            for g in grams:
+                self.postings[g].tofile(fp)
+        os.replace(tmp, self.path)
+
+    def relpath(self, f):
+        return os.path.relpath(f, self.root)
+
+    def is_fresh(self, f, entry):
+        """ whether `entry` still describes file `f` """
+        try:
+            st = os.stat(f)
+        except OSError:
+            return False
+        return entry[1] == st.st_size and entry[2] == st.st_mtime_ns
+
+    def update(self, files):
+        """
+        bring the index up to date with `files` (all the files under root), only the new ones
+        and the ones whose size or mtime changed are read. return (indexed, updated, removed)
+        """
+        seen = set()
+        updated = 0
+        for f in files:
+            rel = self.relpath(f)
+            if os.path.basename(rel) == INDEX_FILE_NAME or rel in seen:
+                continue
+            seen.add(rel)
+            entry = self.files.get(rel)
+            if entry is not None and self.is_fresh(f, entry):
+                continue
+            try:
+                st = os.stat(f)
+                grams = file_trigrams(f)
+            except OSError:
+                continue
+            if entry is not None:
+                self.dead += 1
+            file_id = self.next_id
+            self.next_id += 1
+            self.files[rel] = (file_id, st.st_size, st.st_mtime_ns, grams is None)
+            for g in grams or ():
+                ids = self.postings.get(g)
+                if ids is None:
+                    ids = self.postings[g] = array('I')
+                ids.append(file_id)
+            updated += 1
+
+        removed = [rel for rel in self.files if rel not in seen]
+        for rel in removed:
+            del self.files[rel]
+        self.dead += len(removed)
+        if self.dead > len(self.files):
+            self.compact()
+        return len(self.files), updated, len(removed)
+
+    def compact(self):
+        """ drop the ids of changed and removed files from the postings, renumber the rest """
+        remap = {}
+        for rel, (file_id, size, mtime, binary) in sorted(self.files.items(), key=lambda item: item[1][0]):
+            remap[file_id] = len(remap)
+            self.files[rel] = (remap[file_id], size, mtime, binary)
+        postings = {}
+        for g, ids in self.postings.items():
+            ids = array('I', (remap[i] for i in ids if i in remap))
+            if ids:
+                postings[g] = ids
+        self.postings = postings
+        self.next_id = len(remap)
+        self.dead = 0
+
+    def candidate_ids(self, query):
+        """
+        `query` is a list of alternatives, each a set of trigrams a match must all contain.
+        return the ids of the files that can match, None when the index can't tell
+        """
+        if not query:
+            return None
+        result = set()
+        for grams in query:
+            if not grams:
+                return None
+            ids = None
+            # the shortest posting list first, it narrows the set the most
+            for g in sorted(grams, key=lambda g: len(self.postings.get(g, ()))):
+                posting = self.postings.get(g)
+                if posting is None:
+                    ids = set()
+                    break
+                ids = set(posting) if ids is None else ids.intersection(posting)
+                if not ids:
+                    break
+            result.update(ids)
+        return result
+
+
+class IndexFilter():
+    """ pass through only the files the index can't rule out, counting the pruned ones """
+    def __init__(self, index, query):
+        self.index = index
+        self.ids = index.candidate_ids(query)
+        self.total = 0
+        self.pruned = 0
+
+    def filter(self, files):
+        for f in files:
+            self.total += 1
+            if self.ids is None or not self.pruned_file(f):
+                yield f
+
+    def pruned_file(self, f):
+        entry = self.index.files.get(self.index.relpath(f))
+        # files the index doesn't know about, or knows an older version of, are searched
+        if entry is None or entry[3] or not self.index.is_fresh(f, entry):
+            return False
+        if entry[0] in self.ids:
+            return False
+        self.pruned += 1
+        return True
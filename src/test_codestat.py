@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import tempfile
+import unittest
+
+import codestat
+
+
+class ReadBlocksTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "wb") as fp:
+            fp.write(data)
+        return path
+
+    def test_probe_whatever_block_size(self):
+        data = bytes(range(256)) * 200
+        path = self.write("data", data)
+        for block_size in (1, 4, 1 << 10, 1 << 20):
+            blocks = [bytes(view) for view in codestat.read_blocks(path, block_size, codestat.PROBE_SIZE)]
+            self.assertEqual(len(blocks[0]), codestat.PROBE_SIZE)
+            self.assertEqual(b"".join(blocks), data)
+            self.assertTrue(all(len(block) <= block_size for block in blocks[1:]))
+
+    def test_script_with_small_blocks(self):
+        path = self.write("script", b"#!/bin/sh\necho hi\n")
+        for block_size in (1, 4):
+            info = codestat.count_file(path, block_size)[0]
+            self.assertEqual((info.type, info.code), (".sh", 1))
+
+
+def count(language, data, block_size=1 << 20):
+    """ (code, comment, blank) of data handed to a handler block_size bytes at a time """
+    handler = codestat.Scanner(language).new_handler()
+    view = memoryview(data)
+    for pos in range(0, len(data), block_size):
+        handler.handle(view[pos:pos + block_size])
+    handler.end()
+    return handler.code, handler.comment, handler.blank
+
+
+def language(name):
+    return next(lang for lang in codestat.LANGUAGES if lang.name == name)
+
+
+class ScannerTest(unittest.TestCase):
+    def test_python(self):
+        data = (b'#!/usr/bin/env python3\n'
+                b'"""\n'
+                b'doc # not a comment\n'
+                b'"""\n'
+                b'\n'
+                b'x = "# not a comment"  # comment\n'
+                b'   \t\n'
+                b"y = '''a\n"
+                b"b'''")
+        self.assertEqual(count(language("Python"), data), (6, 1, 2))
+
+    def test_c(self):
+        data = (b'int x; /* starts\n'
+                b' still comment */\n'
+                b'// a line comment with /* in it\n'
+                b'char *s = "/* not a comment";\n'
+                b'/* one */ /* two */\n'
+                b'\n'
+                b'y++; // done\n')
+        self.assertEqual(count(language("C"), data), (3, 3, 1))
+
+    def test_same_counts_for_every_block_size(self):
+        """ lines and tokens split across blocks count as they do in one block """
+        rng = random.Random(1)
+        pieces = [b'/*', b'*/', b'//', b'"', b"'", b'"""', b"'''", b'`', b'\\', b'\n', b'\n\n', b'  ', b'\t',
+                  b'x', b'#', b';', b'--', b'--[[', b']]', b'{-', b'-}', b'<!--', b'-->']
+        samples = [b"".join(rng.choice(pieces) for _ in range(rng.randrange(0, 80))) for _ in range(100)]
+        for lang in codestat.LANGUAGES:
+            for data in samples:
+                expected = count(lang, data)
+                for block_size in (1, 2, 3, 7, 64):
+                    with self.subTest(language=lang.name, data=data, block_size=block_size):
+                        self.assertEqual(count(lang, data, block_size), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
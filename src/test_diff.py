@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import optparse
+import os
+import random
+import tempfile
+import tracemalloc
+import unittest
+
+import diff
+from internal.linediff import LineMatcher
+from internal.mappedlines import MappedLines
+
+
+class MappedDiffTest(unittest.TestCase):
+    LINES = 200000
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        rng = random.Random(1)
+        a = ["line {} {}\n".format(i, rng.randrange(100)) for i in range(self.LINES)]
+        b = list(a)
+        for _ in range(50):
+            b[rng.randrange(len(b))] = "changed\n"
+        self.paths = []
+        for name, lines in (("a", a), ("b", b)):
+            path = os.path.join(self.dir.name, name)
+            with open(path, "w") as fp:
+                fp.writelines(lines)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_mmap_memory(self):
+        """ past the index of the lines, the default engine of --mmap takes next to nothing a line """
+        options = optparse.Values({"algorithm": "difflib", "mmap": True})
+        a, b = MappedLines(self.paths[0]), MappedLines(self.paths[1])
+        try:
+            tracemalloc.start()
+            try:
+                groups = list(LineMatcher(a.hashes, b.hashes, diff.line_algorithm(options)).get_grouped_opcodes(3))
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        finally:
+            a.close()
+            b.close()
+        self.assertTrue(groups)
+        self.assertLess(peak, 4 * self.LINES)
+
+
+if __name__ == "__main__":
+    unittest.main()
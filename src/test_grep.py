@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import pickle
+import tempfile
+import unittest
+
+import grep
+from internal.trigram import INDEX_FILE_NAME, TrigramIndex, IndexFormatError
+
+
+class ContextTest(unittest.TestCase):
+    # line 1 is the only empty one
+    DATA = b"x\n\ny\nz\nw\n"
+
+    def options(self, before, after):
+        options = grep.GrepOptions()
+        options.before = before
+        options.after = after
+        return options
+
+    def test_empty_line_pattern_after_context(self):
+        """ `^$` must not match the empty position after the '\n' of the lines that follow a match """
+        matcher = grep.make_matcher(["^$"])
+        found = [(no, self.DATA[s:e], m) for no, s, e, m in grep.search_file(self.DATA, matcher, self.options(0, 1))]
+        self.assertEqual(found, [(1, b"\n", True), (2, b"y\n", False)])
+
+    def test_empty_line_pattern_stdin(self):
+        matcher = grep.make_matcher(["^ *$"])
+        found = list(grep.search_stream(io.BytesIO(self.DATA), matcher, 1, 1))
+        self.assertEqual(found, [(0, b"x\n", False), (1, b"\n", True), (2, b"y\n", False)])
+
+    def test_line_without_newline(self):
+        """ a line is searched without its '\\n', like GNU grep: only line 0 ends with a space """
+        data = b"a \nb\n\nc\n"
+        matcher = grep.make_matcher([r"\s$"])
+        self.assertEqual([no for no, _, _ in grep.search_lines(data, matcher)], [0])
+        found = [(no, m) for no, s, e, m in grep.search_file(data, matcher, self.options(0, 1))]
+        self.assertEqual(found, [(0, True), (1, False)])
+        self.assertFalse(grep.line_matches(data, matcher, 3, 5))
+
+    def test_line_matches(self):
+        matcher = grep.make_matcher(["$"])
+        self.assertTrue(grep.line_matches(self.DATA, matcher, 0, 2))
+        # buf[2:2] is no line, only the empty position after line 0's '\n'
+        self.assertFalse(grep.line_matches(self.DATA, matcher, 2, 2))
+
+
+class FixedStringsTest(unittest.TestCase):
+    def test_long_words(self):
+        # as long as the recursion limit and more
+        word = bytes(range(32, 127)) * 13
+        matcher = grep.make_matcher([word, word[:600] + b"!", b"abc"], fixed=True)
+        self.assertEqual(matcher.find(b"x" + word + b"\n", 0, len(word) + 2), (1, len(word) + 1))
+        self.assertEqual(matcher.find(b"x" + word[:600] + b"!", 0, 602), (1, 602))
+
+    def test_nested_words(self):
+        matcher = grep.make_matcher([b"a" * k for k in range(1, 1201)], fixed=True)
+        self.assertEqual(matcher.find(b"xaaab", 0, 5), (1, 4))
+
+
+class MaxCountTest(unittest.TestCase):
+    def test_max_count_zero_reads_nothing(self):
+        options = grep.GrepOptions()
+        options.max_count = 0
+        options.count = True
+        out = io.BytesIO()
+
+        def lines():
+            raise AssertionError("a line was read")
+            yield
+
+        self.assertEqual(grep.report(b"f", lines(), options, out), 0)
+        self.assertEqual(out.getvalue(), b"")
+
+    def test_max_count(self):
+        options = grep.GrepOptions()
+        options.max_count = 1
+        out = io.BytesIO()
+        lines = [(0, b"a\n", True), (1, b"b\n", True)]
+        self.assertEqual(grep.report(b"f", iter(lines), options, out), 1)
+        self.assertEqual(out.getvalue(), b"f:0: a\n")
+
+
+class TrigramIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = self.dir.name
+        for name, data in (("a.txt", b"hello world\n"), ("b.txt", b"goodbye\n"), ("c.bin", b"\0xyz")):
+            with open(os.path.join(self.root, name), "wb") as fp:
+                fp.write(data)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def files(self):
+        return [os.path.join(self.root, name) for name in ("a.txt", "b.txt", "c.bin")]
+
+    def test_save_load(self):
+        index = TrigramIndex(self.root)
+        index.update(self.files())
+        index.save()
+        loaded = TrigramIndex(self.root)
+        loaded.load()
+        self.assertEqual(loaded.files, index.files)
+        self.assertEqual(loaded.postings, index.postings)
+        self.assertEqual((loaded.next_id, loaded.dead), (index.next_id, index.dead))
+        self.assertEqual(loaded.candidate_ids([{b"wor", b"orl"}]), {index.files["a.txt"][0]})
+
+    def test_walk_skips_index(self):
+        index = TrigramIndex(self.root)
+        index.update(self.files())
+        index.save()
+        walked = sorted(grep.DirWalker().walk(self.root))
+        self.assertEqual(walked, sorted(self.files()))
+
+    def test_pickle_is_not_loaded(self):
+        with open(os.path.join(self.root, INDEX_FILE_NAME), "wb") as fp:
+            pickle.dump({"version": 1}, fp)
+        with self.assertRaises(IndexFormatError):
+            TrigramIndex(self.root).load()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import difflib
+import random
+import unittest
+from unittest import mock
+
+from internal import linediff
+from internal.linediff import ALGORITHMS, LineMatcher, intern_lines, matching_blocks
+
+
+def random_pair(rng):
+    """ two line lists with edits of a few kinds: few or many distinct lines, blocks moved """
+    alphabet = rng.choice((3, 8, 40))
+    a = [rng.randrange(alphabet) for _ in range(rng.randrange(0, 60))]
+    b = list(a)
+    for _ in range(rng.randrange(0, 8)):
+        kind = rng.randrange(4)
+        i = rng.randrange(len(b) + 1)
+        if kind == 0:
+            b[i:i] = [rng.randrange(alphabet) for _ in range(rng.randrange(1, 5))]
+        elif kind == 1:
+            del b[i:i + rng.randrange(1, 5)]
+        elif kind == 2 and b:
+            b[i % len(b)] = rng.randrange(alphabet)
+        else:
+            j = rng.randrange(len(b) + 1)
+            b[i:j] = b[i:j][::-1]
+    return [str(x) for x in a], [str(x) for x in b]
+
+
+def lcs_length(a, b):
+    row = [0] * (len(b) + 1)
+    for x in a:
+        prev = 0
+        for j, y in enumerate(b):
+            cur = row[j + 1]
+            row[j + 1] = prev + 1 if x == y else max(row[j + 1], row[j])
+            prev = cur
+    return row[-1]
+
+
+class MatchingBlocksTest(unittest.TestCase):
+    def check(self, a, b, algorithm):
+        """ the blocks are in order, match equal lines and end as difflib's do """
+        ia, ib = intern_lines(a, b)
+        blocks = matching_blocks(ia, ib, algorithm)
+        self.assertEqual(blocks[-1], (len(a), len(b), 0))
+        i = j = 0
+        for k, (ai, bj, size) in enumerate(blocks[:-1]):
+            self.assertGreater(size, 0)
+            self.assertGreaterEqual(ai, i)
+            self.assertGreaterEqual(bj, j)
+            if k:
+                # adjacent blocks are merged
+                self.assertFalse(ai == i and bj == j)
+            self.assertEqual(a[ai:ai + size], b[bj:bj + size])
+            i, j = ai + size, bj + size
+        # the opcodes turn a into b
+        rebuilt = []
+        for tag, i1, i2, j1, j2 in LineMatcher(ia, ib, algorithm).get_opcodes():
+            if tag == "equal":
+                self.assertEqual(a[i1:i2], b[j1:j2])
+                rebuilt += a[i1:i2]
+            elif tag in ("replace", "insert"):
+                rebuilt += b[j1:j2]
+        self.assertEqual(rebuilt, b)
+        return sum(size for _, _, size in blocks)
+
+    def test_random(self):
+        rng = random.Random(1)
+        for _ in range(300):
+            a, b = random_pair(rng)
+            for algorithm in ALGORITHMS:
+                with self.subTest(a=a, b=b, algorithm=algorithm):
+                    matched = self.check(a, b, algorithm)
+                    if algorithm == "myers":
+                        # below the cost limit Myers finds a longest common subsequence
+                        self.assertEqual(matched, lcs_length(a, b))
+
+    def test_past_cost_limit(self):
+        """ every region gives up on the shortest script, the split and the dropped lines have to hold """
+        rng = random.Random(2)
+        with mock.patch.object(linediff, "_MIN_COST", 1), mock.patch.object(linediff, "_FIRST_DIAGONALS", 1):
+            for _ in range(300):
+                a, b = random_pair(rng)
+                for algorithm in ALGORITHMS:
+                    with self.subTest(a=a, b=b, algorithm=algorithm):
+                        self.check(a, b, algorithm)
+
+    def test_nothing_in_common(self):
+        a = [str(i) for i in range(4000)]
+        b = [str(i) for i in range(4000, 8000)]
+        for algorithm in ALGORITHMS:
+            self.assertEqual(self.check(a, b, algorithm), 0)
+
+    def test_every_other_line_changed(self):
+        a = ["line {}".format(i) for i in range(20000)]
+        b = [x if i % 2 == 0 else "changed {}".format(i) for i, x in enumerate(a)]
+        for algorithm in ALGORITHMS:
+            self.assertEqual(self.check(a, b, algorithm), 10000)
+
+    def test_histogram_unique_anchors(self):
+        """ runs of lines occurring once on both sides are all anchors, in order, overlaps dropped """
+        a = ["x", "a", "b", "y", "c", "z", "x", "d"]
+        b = ["d", "a", "b", "q", "c", "x", "z"]
+        self.check(a, b, "histogram")
+
+
+class OpcodesTest(unittest.TestCase):
+    def test_same_blocks_as_difflib(self):
+        """ given difflib's blocks, the opcodes and hunks are difflib's """
+        rng = random.Random(3)
+        for _ in range(300):
+            a, b = random_pair(rng)
+            expected = difflib.SequenceMatcher(None, a, b, autojunk=False)
+            matcher = LineMatcher(*intern_lines(a, b))
+            matcher.blocks = [tuple(block) for block in expected.get_matching_blocks()]
+            self.assertEqual(matcher.get_opcodes(), expected.get_opcodes())
+            for n in (0, 1, 3):
+                # difflib's get_grouped_opcodes() edits the opcodes it keeps, a new one each time
+                expected = difflib.SequenceMatcher(None, a, b, autojunk=False)
+                self.assertEqual(list(matcher.get_grouped_opcodes(n)), list(expected.get_grouped_opcodes(n)))
+
+    def test_unambiguous_edits(self):
+        """ where there's one best diff every engine finds difflib's """
+        rng = random.Random(4)
+        for _ in range(50):
+            a = ["line {}".format(i) for i in range(200)]
+            b = list(a)
+            for _ in range(5):
+                i = rng.randrange(len(b))
+                b[i:i + rng.randrange(0, 3)] = ["new {}".format(rng.random()) for _ in range(rng.randrange(0, 3))]
+            expected = list(difflib.SequenceMatcher(None, a, b, autojunk=False).get_grouped_opcodes(3))
+            for algorithm in ALGORITHMS:
+                with self.subTest(algorithm=algorithm):
+                    got = list(LineMatcher(*intern_lines(a, b), algorithm=algorithm).get_grouped_opcodes(3))
+                    self.assertEqual(got, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()